@@ -6,7 +6,7 @@ from msgspec import Struct
 from sentence_transformers import CrossEncoder
 
 DEFAULT_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
-WORKER_NUM = environ.get("WORKER_NUM", 1)
+WORKER_NUM = int(environ.get("WORKER_NUM", 1))
 
 
 class Request(Struct, kw_only=True):
@@ -0,0 +1,398 @@
+from __future__ import annotations
+
+import asyncio
+from functools import partial
+from time import perf_counter
+from typing import Any, Awaitable
+
+from qtext.breaker import CircuitBreaker
+from qtext.cache import LRUCache, SemanticCache, normalize_query
+from qtext.coalesce import AsyncCoalescer
+from qtext.config import Config
+from qtext.emb_client import (
+    AsyncCohereEmbeddingClient,
+    AsyncEmbeddingClient,
+    AsyncSparseEmbeddingClient,
+)
+from qtext.engine import (
+    UNAVAILABLE_ERRORS,
+    LegResult,
+    ResultKey,
+    SearchResult,
+    combine,
+    is_inline,
+    is_remote,
+    render_highlight,
+    result_key,
+    semantic_scope,
+    unranked,
+)
+from qtext.highlight_client import AsyncHighlightClient
+from qtext.log import logger
+from qtext.metrics import degrade_counter, rerank_histogram
+from qtext.pg_client import AsyncPgVectorsClient
+from qtext.schema import DefaultTable, Querier
+from qtext.spec import (
+    AddNamespaceRequest,
+    HighlightRequest,
+    HighlightResponse,
+    QueryDocRequest,
+    QueryExplainResponse,
+    Record,
+    SparseArray,
+)
+from qtext.utils import Deadline, batched, time_it
+
+
+class AsyncRetrievalEngine:
+    """The asyncio version of the `RetrievalEngine`.
+
+    All the I/O (postgres, embedding, sparse embedding, highlight and the remote
+    rankers) is awaited in the event loop, so one process can serve lots of
+    in-flight queries without a thread for each of them.
+    """
+
+    def __init__(self, config: Config) -> None:
+        self.ranker = config.ranker.ranker(**config.ranker.params)
+        self.querier = Querier(
+            config.vector_store.schema,
+            required_fields=getattr(self.ranker, "required_fields", None),
+        )
+        self.req_cls = self.querier.generate_request_class()
+        self.resp_cls = self.querier.table_type
+        self.pg_client = AsyncPgVectorsClient(config.vector_store, querier=self.querier)
+        self.highlight_client = AsyncHighlightClient(config.highlight.addr)
+        if config.embedding.client == "openai":
+            self.emb_client = AsyncEmbeddingClient(
+                model_name=config.embedding.model_name,
+                api_key=config.embedding.api_key,
+                endpoint=config.embedding.api_endpoint,
+                timeout=config.embedding.timeout,
+            )
+        else:
+            self.emb_client = AsyncCohereEmbeddingClient(
+                model_name=config.embedding.model_name,
+                api_key=config.embedding.api_key,
+            )
+        self.sparse_client = AsyncSparseEmbeddingClient(
+            endpoint=config.sparse.addr,
+            dim=config.sparse.dim,
+            timeout=config.sparse.timeout,
+        )
+        self.emb_breaker = CircuitBreaker("embedding", config.breaker)
+        self.sparse_breaker = CircuitBreaker("sparse", config.breaker)
+        # a coalesced batch goes through the breaker once
+        self.embed_query = partial(self.emb_breaker.acall, self.emb_client.embedding)
+        if config.embedding.coalesce_window > 0:
+            self.embed_query = AsyncCoalescer(
+                "embedding",
+                partial(self.emb_breaker.acall, self.emb_client.embeddings),
+                config.embedding.coalesce_window,
+                config.embedding.coalesce_max_batch,
+            )
+        self.embed_sparse_query = partial(
+            self.sparse_breaker.acall, self.sparse_client.sparse_embedding
+        )
+        if config.sparse.coalesce_window > 0:
+            self.embed_sparse_query = AsyncCoalescer(
+                "sparse",
+                partial(
+                    self.sparse_breaker.acall, self.sparse_client.sparse_embeddings
+                ),
+                config.sparse.coalesce_window,
+                config.sparse.coalesce_max_batch,
+            )
+        self.highlight_breaker = CircuitBreaker("highlight", config.breaker)
+        self.rank_breaker = CircuitBreaker("rank", config.breaker)
+        self.emb_cache: LRUCache[tuple[str, str], list[float]] = LRUCache(
+            "embedding", config.embedding.cache_size, config.embedding.cache_ttl
+        )
+        self.sparse_cache: LRUCache[tuple[str, str], SparseArray] = LRUCache(
+            "sparse", config.sparse.cache_size, config.sparse.cache_ttl
+        )
+        self.sparse_model = config.sparse.addr
+        self.emb_batch_size = config.embedding.batch_size
+        self.sparse_batch_size = config.sparse.batch_size
+        self.result_cache: LRUCache[ResultKey, bytes] = LRUCache(
+            "result",
+            config.query.result_cache_size,
+            config.query.result_cache_ttl,
+            weigher=len,
+            max_weight=config.query.result_cache_max_bytes,
+        )
+        self.semantic_cache: SemanticCache[list[DefaultTable]] = SemanticCache(
+            "semantic",
+            config.query.semantic_cache_size,
+            config.query.semantic_cache_threshold,
+        )
+        if config.ingest.enabled:
+            logger.warning("the ingest queue is not supported by the asyncio engine")
+        self.default_deadline = config.query.deadline
+        self.hybrid_sql = config.query.hybrid_sql
+        if self.hybrid_sql and self.querier.primary_key is None:
+            logger.warning("hybrid SQL is disabled since the schema has no primary key")
+            self.hybrid_sql = False
+
+    def result_key(self, req: QueryDocRequest) -> ResultKey:
+        return result_key(self.pg_client.versions, req)
+
+    async def open(self) -> None:
+        await self.pg_client.open()
+
+    async def close(self) -> None:
+        await self.pg_client.close()
+
+    @time_it
+    async def add_namespace(self, req: AddNamespaceRequest) -> None:
+        await self.pg_client.add_namespace(req)
+
+    @time_it
+    async def add_doc(self, req) -> None:
+        await self.fill_embeddings(req)
+        await self.pg_client.add_doc(req)
+
+    @time_it
+    async def add_docs(self, reqs: list) -> None:
+        await self.fill_embeddings_batch(reqs)
+        await self.pg_client.add_docs(reqs)
+
+    async def fill_vectors(self, reqs: list) -> None:
+        missing = [req for req in reqs if not self.querier.retrieve_vector(req)]
+        for batch in batched(missing, self.emb_batch_size):
+            vectors = await self.emb_breaker.acall(
+                self.emb_client.embeddings,
+                [self.querier.retrieve_text(req) for req in batch],
+            )
+            for req, vector in zip(batch, vectors):
+                self.querier.fill_vector(req, vector)
+
+    async def fill_sparse_vectors(self, reqs: list) -> None:
+        missing = [req for req in reqs if not self.querier.retrieve_sparse_vector(req)]
+        for batch in batched(missing, self.sparse_batch_size):
+            sparse = await self.sparse_breaker.acall(
+                self.sparse_client.sparse_embeddings,
+                [self.querier.retrieve_text(req) for req in batch],
+            )
+            for req, vector in zip(batch, sparse):
+                self.querier.fill_sparse_vector(req, vector)
+
+    async def fill_embeddings_batch(self, reqs: list) -> None:
+        """Generate the missing vectors in batches, dense and sparse concurrently."""
+        if not self.querier.has_text_index():
+            return
+        tasks = []
+        if self.querier.has_vector_index():
+            tasks.append(self.fill_vectors(reqs))
+        if self.querier.has_sparse_index():
+            tasks.append(self.fill_sparse_vectors(reqs))
+        await asyncio.gather(*tasks)
+
+    async def fill_vector(self, req) -> None:
+        if not self.querier.retrieve_vector(req):
+            text = self.querier.retrieve_text(req)
+            self.querier.fill_vector(
+                req, await self.emb_breaker.acall(self.emb_client.embedding, text)
+            )
+
+    async def fill_sparse_vector(self, req) -> None:
+        if not self.querier.retrieve_sparse_vector(req):
+            text = self.querier.retrieve_text(req)
+            self.querier.fill_sparse_vector(
+                req,
+                await self.sparse_breaker.acall(
+                    self.sparse_client.sparse_embedding, text
+                ),
+            )
+
+    async def fill_embeddings(self, req) -> None:
+        """Generate the vectors that are not provided by the user."""
+        if not self.querier.has_text_index():
+            return
+        tasks = []
+        if self.querier.has_vector_index():
+            tasks.append(self.fill_vector(req))
+        if self.querier.has_sparse_index():
+            tasks.append(self.fill_sparse_vector(req))
+        await asyncio.gather(*tasks)
+
+    async def rank(
+        self, req: QueryDocRequest, docs: list[Record]
+    ) -> list[DefaultTable]:
+        with rerank_histogram.time():
+            if is_remote(self.ranker):
+                ranked = await self.rank_breaker.acall(
+                    self.ranker.arank, req.to_record(), docs
+                )
+            else:
+                ranked = await self.ranker.arank(req.to_record(), docs)
+        return [DefaultTable.from_record(record) for record in ranked]
+
+    async def query_embedding(self, query: str) -> list[float]:
+        """Embed the query, the same normalized text is served from the cache."""
+        key = (self.emb_client.model_name, normalize_query(query))
+        vector = self.emb_cache.get(key)
+        if vector is None:
+            vector = await self.embed_query(key[1])
+            self.emb_cache.put(key, vector)
+        return vector
+
+    async def query_sparse_embedding(self, query: str) -> SparseArray:
+        key = (self.sparse_model, normalize_query(query))
+        sparse = self.sparse_cache.get(key)
+        if sparse is None:
+            sparse = await self.embed_sparse_query(key[1])
+            self.sparse_cache.put(key, sparse)
+        return sparse
+
+    async def fill_query_vector(self, req: QueryDocRequest) -> None:
+        if self.querier.has_vector_index() and not req.vector:
+            req.vector = await self.query_embedding(req.query)
+
+    async def fill_query_sparse_vector(self, req: QueryDocRequest) -> None:
+        if self.querier.has_sparse_index() and not req.sparse_vector:
+            req.sparse_vector = await self.query_sparse_embedding(req.query)
+
+    async def text_leg(self, req: QueryDocRequest) -> LegResult:
+        start_time = perf_counter()
+        results = await self.pg_client.query_text(req)
+        return results, perf_counter() - start_time
+
+    async def vector_leg(self, req: QueryDocRequest) -> LegResult:
+        await self.fill_query_vector(req)
+        start_time = perf_counter()
+        results = await self.pg_client.query_vector(req)
+        return results, perf_counter() - start_time
+
+    async def sparse_leg(self, req: QueryDocRequest) -> LegResult:
+        await self.fill_query_sparse_vector(req)
+        start_time = perf_counter()
+        results = await self.pg_client.query_sparse_vector(req)
+        return results, perf_counter() - start_time
+
+    def deadline(self, req: QueryDocRequest) -> Deadline:
+        return Deadline(req.deadline or self.default_deadline)
+
+    async def within(self, deadline: Deadline, coro: Awaitable) -> tuple[bool, Any]:
+        """Await the `coro`, return `(False, None)` if it's late or unavailable.
+
+        The late `coro` is cancelled, it's unavailable if its circuit breaker is open
+        or it times out, the same as the sync engine.
+        """
+        try:
+            return True, await asyncio.wait_for(coro, deadline.remaining())
+        except (asyncio.TimeoutError, *UNAVAILABLE_ERRORS):
+            return False, None
+
+    async def retrieve(
+        self, req: QueryDocRequest, deadline: Deadline | None = None
+    ) -> tuple[dict[str, LegResult], list[str]]:
+        """Run the retrieval legs, the late or unavailable ones are skipped."""
+        deadline = deadline or Deadline()
+        tasks = {
+            "text": asyncio.ensure_future(self.text_leg(req)),
+            "vector": asyncio.ensure_future(self.vector_leg(req)),
+            "sparse": asyncio.ensure_future(self.sparse_leg(req)),
+        }
+        done, _ = await asyncio.wait(tasks.values(), timeout=deadline.remaining())
+        results: dict[str, LegResult] = {}
+        skipped: list[str] = []
+        for name, task in tasks.items():
+            if task not in done:
+                task.cancel()
+                skipped.append(name)
+            elif isinstance(task.exception(), UNAVAILABLE_ERRORS):
+                skipped.append(name)
+            else:
+                results[name] = task.result()
+        for name in skipped:
+            results[name] = ([], 0.0)
+            degrade_counter.labels(name).inc()
+        return results, skipped
+
+    async def retrieve_hybrid(self, req: QueryDocRequest) -> list[Record]:
+        await asyncio.gather(
+            self.fill_query_vector(req), self.fill_query_sparse_vector(req)
+        )
+        return self.querier.combine_hybrid(await self.pg_client.query_hybrid(req))
+
+    async def rank_within(
+        self, req: QueryDocRequest, docs: list[Record], deadline: Deadline
+    ) -> tuple[list[DefaultTable], bool]:
+        if is_inline(self.ranker):
+            return await self.rank(req, docs), True
+        reranked, ranked = await self.within(deadline, self.rank(req, docs))
+        if not reranked:
+            degrade_counter.labels("rank").inc()
+            return unranked(req, docs), False
+        return ranked, True
+
+    @time_it
+    async def query(self, req: QueryDocRequest) -> list[DefaultTable]:
+        return (await self.search(req))[0]
+
+    async def search(self, req: QueryDocRequest) -> SearchResult:
+        deadline = self.deadline(req)
+        if not self.semantic_cache.enabled or not self.querier.has_vector_index():
+            return await self.retrieve_and_rank(req, deadline)
+
+        scope = semantic_scope(self.pg_client.versions, req)
+        embedded, _ = await self.within(deadline, self.fill_query_vector(req))
+        if not embedded:
+            return await self.retrieve_and_rank(req, deadline)
+        docs = self.semantic_cache.get(scope, req.vector)
+        if docs is not None:
+            return docs, []
+        docs, skipped = await self.retrieve_and_rank(req, deadline)
+        if not skipped:
+            self.semantic_cache.put(scope, req.vector, docs)
+        return docs, skipped
+
+    async def retrieve_and_rank(
+        self, req: QueryDocRequest, deadline: Deadline
+    ) -> SearchResult:
+        # an unavailable embedding service skips its leg instead of the statement
+        retrieved, docs, skipped = False, [], []
+        if self.hybrid_sql and self.emb_breaker.closed and self.sparse_breaker.closed:
+            retrieved, docs = await self.within(deadline, self.retrieve_hybrid(req))
+            if not retrieved:
+                # the separate legs still serve the text search in the time left
+                degrade_counter.labels("hybrid").inc()
+                skipped = ["hybrid"]
+        if not retrieved:
+            results, skipped_legs = await self.retrieve(req, deadline)
+            docs = combine(self.querier, results)
+            skipped.extend(skipped_legs)
+        ranked, reranked = await self.rank_within(req, docs, deadline)
+        if not reranked:
+            skipped.append("rank")
+        return ranked, skipped
+
+    @time_it
+    async def query_explain(self, req: QueryDocRequest) -> QueryExplainResponse:
+        deadline = self.deadline(req)
+        results, skipped = await self.retrieve(req, deadline)
+        explain = QueryExplainResponse()
+        for name, retrieved in (
+            ("vector", explain.vector),
+            ("sparse", explain.sparse),
+            ("text", explain.text),
+        ):
+            docs, retrieved.elapsed = results[name]
+            retrieved.docs = [doc.to_record().simplify() for doc in docs]
+
+        rank_time = perf_counter()
+        ranked, reranked = await self.rank_within(
+            req, combine(self.querier, results), deadline
+        )
+        explain.ranked.elapsed = perf_counter() - rank_time
+        explain.ranked.docs = [rank.to_record().simplify() for rank in ranked]
+        explain.ranked.fill_hybrid_ids(explain.vector, explain.sparse, explain.text)
+        explain.skipped = skipped if reranked else [*skipped, "rank"]
+        return explain
+
+    @time_it
+    async def highlight(self, req: HighlightRequest) -> HighlightResponse:
+        text_scores = await self.highlight_breaker.acall(
+            self.highlight_client.highlight_score, req.query, req.docs
+        )
+        return render_highlight(req, text_scores)
@@ -0,0 +1,188 @@
+from __future__ import annotations
+
+import falcon
+import msgspec
+from defspec import RenderTemplate
+from falcon.asgi import App, Request, Response
+
+from qtext.async_engine import AsyncRetrievalEngine
+from qtext.breaker import CircuitOpenError
+from qtext.server import (
+    CACHE_HIT,
+    CACHE_MISS,
+    CACHE_STATUS,
+    SKIPPED,
+    HealthCheck,
+    OpenAPIRender,
+    OpenAPIResource,
+    OpenMetrics,
+    circuit_open_handler,
+    decode_request,
+    encode_docs,
+    uncaught_exception_handler,
+)
+from qtext.spec import AddNamespaceRequest, HighlightRequest, QueryDocRequest
+
+
+async def validate_request(spec: type[msgspec.Struct], req: Request, resp: Response):
+    return decode_request(spec, await req.stream.read(), req, resp)
+
+
+async def async_uncaught_exception_handler(
+    req: Request, resp: Response, exc: Exception, params: dict
+):
+    uncaught_exception_handler(req, resp, exc, params)
+
+
+async def async_circuit_open_handler(
+    req: Request, resp: Response, exc: CircuitOpenError, params: dict
+):
+    circuit_open_handler(req, resp, exc, params)
+
+
+class Lifespan:
+    def __init__(self, engine: AsyncRetrievalEngine) -> None:
+        self.engine = engine
+
+    async def process_startup(self, scope, event):
+        await self.engine.open()
+
+    async def process_shutdown(self, scope, event):
+        await self.engine.close()
+
+
+class AsyncHealthCheck(HealthCheck):
+    async def on_get(self, req: Request, resp: Response):
+        super().on_get(req, resp)
+
+
+class DocResource:
+    def __init__(self, engine: AsyncRetrievalEngine) -> None:
+        self.engine = engine
+
+    async def on_post(self, req: Request, resp: Response):
+        request = await validate_request(self.engine.req_cls, req, resp)
+        if request is None:
+            return
+
+        await self.engine.add_doc(request)
+
+
+class DocsResource:
+    def __init__(self, engine: AsyncRetrievalEngine) -> None:
+        self.engine = engine
+
+    async def on_post(self, req: Request, resp: Response):
+        request = await validate_request(list[self.engine.req_cls], req, resp)
+        if request is None:
+            return
+
+        await self.engine.add_docs(request)
+
+
+class QueryResource:
+    def __init__(self, engine: AsyncRetrievalEngine) -> None:
+        self.engine = engine
+
+    async def on_post(self, req: Request, resp: Response):
+        request = await validate_request(QueryDocRequest, req, resp)
+        if request is None:
+            return
+
+        cache = self.engine.result_cache
+        key = self.engine.result_key(request) if cache.enabled else None
+        data = cache.get(key)
+        if data is not None:
+            resp.set_header(CACHE_STATUS, CACHE_HIT)
+        else:
+            docs, skipped = await self.engine.search(request)
+            data = encode_docs(docs, request.fields)
+            if skipped:
+                # the degraded results are not cached
+                resp.set_header(SKIPPED, ", ".join(skipped))
+            elif cache.enabled:
+                cache.put(key, data)
+                resp.set_header(CACHE_STATUS, CACHE_MISS)
+        resp.data = data
+        resp.content_type = falcon.MEDIA_JSON
+
+
+class QueryExplainResource:
+    def __init__(self, engine: AsyncRetrievalEngine) -> None:
+        self.engine = engine
+
+    async def on_post(self, req: Request, resp: Response):
+        request = await validate_request(QueryDocRequest, req, resp)
+        if request is None:
+            return
+
+        docs = await self.engine.query_explain(request)
+        resp.data = msgspec.json.encode(docs)
+        resp.content_type = falcon.MEDIA_JSON
+
+
+class NamespaceResource:
+    def __init__(self, engine: AsyncRetrievalEngine) -> None:
+        self.engine = engine
+
+    async def on_post(self, req: Request, resp: Response):
+        request = await validate_request(AddNamespaceRequest, req, resp)
+        if request is None:
+            return
+        await self.engine.add_namespace(request)
+
+
+class HighlightResource:
+    def __init__(self, engine: AsyncRetrievalEngine) -> None:
+        self.engine = engine
+
+    async def on_post(self, req: Request, resp: Response):
+        request = await validate_request(HighlightRequest, req, resp)
+        if request is None:
+            return
+
+        resp.data = msgspec.json.encode(await self.engine.highlight(request))
+        resp.content_type = falcon.MEDIA_JSON
+
+
+class AsyncOpenAPIResource(OpenAPIResource):
+    async def on_get(self, req: Request, resp: Response):
+        super().on_get(req, resp)
+
+
+class AsyncOpenAPIRender(OpenAPIRender):
+    async def on_get(self, req: Request, resp: Response):
+        super().on_get(req, resp)
+
+
+class AsyncOpenMetrics(OpenMetrics):
+    async def on_get(self, req: Request, resp: Response):
+        super().on_get(req, resp)
+
+
+def create_asgi_app(engine: AsyncRetrievalEngine) -> App:
+    app = App(middleware=[Lifespan(engine)])
+    app.add_route("/", AsyncHealthCheck())
+    app.add_route("/metrics", AsyncOpenMetrics())
+    app.add_route("/api/namespace", NamespaceResource(engine))
+    app.add_route("/api/doc", DocResource(engine))
+    app.add_route("/api/docs", DocsResource(engine))
+    app.add_route("/api/query", QueryResource(engine))
+    app.add_route("/api/query_explain", QueryExplainResource(engine))
+    app.add_route("/api/highlight", HighlightResource(engine))
+    app.add_route("/openapi/spec.json", AsyncOpenAPIResource(engine))
+    app.add_route(
+        "/openapi/swagger",
+        AsyncOpenAPIRender("/openapi/spec.json", RenderTemplate.SWAGGER),
+    )
+    app.add_route(
+        "/openapi/redoc",
+        AsyncOpenAPIRender("/openapi/spec.json", RenderTemplate.REDOC),
+    )
+    app.add_route(
+        "/openapi/scalar",
+        AsyncOpenAPIRender("/openapi/spec.json", RenderTemplate.SCALAR),
+    )
+    app.add_error_handler(Exception, async_uncaught_exception_handler)
+    app.add_error_handler(CircuitOpenError, async_circuit_open_handler)
+    return app
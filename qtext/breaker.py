@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+import asyncio
+import threading
+from enum import IntEnum
+from time import monotonic, perf_counter
+
+from qtext.config import BreakerConfig
+from qtext.log import logger
+from qtext.metrics import circuit_state_gauge
+from qtext.utils import DeadlineExceededError
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitState(IntEnum):
+    CLOSED = 0
+    OPEN = 1
+    HALF_OPEN = 2
+
+
+class CircuitBreaker:
+    """Fail fast when a dependency keeps failing.
+
+    The circuit opens after `failure_threshold` consecutive failures, a call slower
+    than `latency_threshold` also counts as a failure. A call that runs out of the
+    request deadline only counts if it's slow, a client with a tiny deadline must
+    not open the circuit for everyone. The calls are rejected with
+    `CircuitOpenError` for `reset_timeout` seconds, then one probe call is let
+    through (half-open): the circuit closes if it succeeds, or opens again.
+    """
+
+    def __init__(self, name: str, config: BreakerConfig) -> None:
+        self.name = name
+        self.enabled = config.enabled
+        self.failure_threshold = config.failure_threshold
+        self.latency_threshold = config.latency_threshold
+        self.reset_timeout = config.reset_timeout
+        self.state = CircuitState.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.lock = threading.Lock()
+        circuit_state_gauge.labels(name).set(self.state)
+
+    @property
+    def closed(self) -> bool:
+        return not self.enabled or self.state == CircuitState.CLOSED
+
+    def set_state(self, state: CircuitState):
+        if state != self.state:
+            logger.info("circuit breaker '%s': %s -> %s", self.name, self.state, state)
+        self.state = state
+        circuit_state_gauge.labels(self.name).set(state)
+
+    def allow(self) -> bool:
+        """Return if the call is the probe, raise `CircuitOpenError` if it's skipped."""
+        with self.lock:
+            if self.state == CircuitState.CLOSED:
+                return False
+            if (
+                self.state == CircuitState.OPEN
+                and monotonic() - self.opened_at >= self.reset_timeout
+            ):
+                self.set_state(CircuitState.HALF_OPEN)
+            if self.state == CircuitState.HALF_OPEN and not self.probing:
+                self.probing = True
+                return True
+        raise CircuitOpenError(f"{self.name} is unavailable")
+
+    def record(self, success: bool, probe: bool = False):
+        """Record the result, only the probe decides when the circuit isn't closed.
+
+        The calls that started before the circuit opened may finish during the
+        probe, they must not release or decide it.
+        """
+        with self.lock:
+            if probe:
+                self.probing = False
+            elif self.state != CircuitState.CLOSED:
+                return
+            if success:
+                self.failures = 0
+                self.set_state(CircuitState.CLOSED)
+                return
+            self.failures += 1
+            if (
+                self.state == CircuitState.HALF_OPEN
+                or self.failures >= self.failure_threshold
+            ):
+                self.opened_at = monotonic()
+                self.set_state(CircuitState.OPEN)
+
+    def is_slow(self, elapsed: float) -> bool:
+        return 0 < self.latency_threshold < elapsed
+
+    def finish(self, probe: bool, success: bool | None):
+        """Record the result, `None` means the call was interrupted.
+
+        An interrupted probe is released without a result, or the circuit would
+        reject all the calls forever.
+        """
+        if success is not None:
+            self.record(success, probe)
+        elif probe:
+            with self.lock:
+                self.probing = False
+
+    def call(self, func, *args, **kwargs):
+        if not self.enabled:
+            return func(*args, **kwargs)
+        probe = self.allow()
+        start_time = perf_counter()
+        success = None
+        try:
+            result = func(*args, **kwargs)
+            success = not self.is_slow(perf_counter() - start_time)
+        except DeadlineExceededError:
+            # the request deadline is set by the client, only a slow call counts
+            if self.is_slow(perf_counter() - start_time):
+                success = False
+            raise
+        except Exception:
+            success = False
+            raise
+        finally:
+            self.finish(probe, success)
+        return result
+
+    async def acall(self, func, *args, **kwargs):
+        if not self.enabled:
+            return await func(*args, **kwargs)
+        probe = self.allow()
+        start_time = perf_counter()
+        success = None
+        try:
+            result = await func(*args, **kwargs)
+            success = not self.is_slow(perf_counter() - start_time)
+        except (DeadlineExceededError, asyncio.CancelledError):
+            # cancelled by the request deadline, the same as the sync `call`
+            if self.is_slow(perf_counter() - start_time):
+                success = False
+            raise
+        except Exception:
+            success = False
+            raise
+        finally:
+            self.finish(probe, success)
+        return result
@@ -0,0 +1,295 @@
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable, Hashable
+from hashlib import blake2b
+from time import monotonic
+from typing import Generic, TypeVar
+
+import numpy as np
+
+from qtext.metrics import cache_counter
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+# (namespace, namespace version, anything else that changes the result)
+SemanticScope = tuple[str, int, Hashable]
+
+
+def normalize_query(text: str) -> str:
+    """Collapse the whitespace so the same query always hits the same key."""
+    return " ".join(text.split())
+
+
+class LRUCache(Generic[K, V]):
+    """A thread-safe LRU cache with an optional time-to-live.
+
+    Args:
+        name: the `cache` label of the Prometheus metrics.
+        max_size: the max number of entries, `0` disables the cache.
+        ttl: seconds before an entry expires, `0` means never.
+        weigher: the weight of a value, e.g. the number of bytes.
+        max_weight: the max total weight, `0` means unbounded.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        name: str,
+        max_size: int,
+        ttl: float = 0,
+        weigher: Callable[[V], int] | None = None,
+        max_weight: int = 0,
+    ) -> None:
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self.weigher = weigher
+        self.max_weight = max_weight
+        self.weight = 0
+        self.entries: OrderedDict[K, tuple[V, float, int]] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    def get(self, key: K) -> V | None:
+        if not self.enabled:
+            return None
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self.ttl and entry[1] < monotonic():
+                del self.entries[key]
+                self.weight -= entry[2]
+                cache_counter.labels(self.name, "expired").inc()
+                entry = None
+            if entry is None:
+                cache_counter.labels(self.name, "miss").inc()
+                return None
+            self.entries.move_to_end(key)
+        cache_counter.labels(self.name, "hit").inc()
+        return entry[0]
+
+    def put(self, key: K, value: V) -> None:
+        if not self.enabled:
+            return
+        expire = monotonic() + self.ttl if self.ttl else 0
+        weight = self.weigher(value) if self.weigher is not None else 0
+        if self.max_weight and weight > self.max_weight:
+            return
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.weight -= previous[2]
+            self.entries[key] = (value, expire, weight)
+            self.weight += weight
+            evicted = 0
+            while len(self.entries) > self.max_size or (
+                self.max_weight and self.weight > self.max_weight
+            ):
+                _, (_, _, evicted_weight) = self.entries.popitem(last=False)
+                self.weight -= evicted_weight
+                evicted += 1
+        if evicted:
+            cache_counter.labels(self.name, "eviction").inc(evicted)
+
+    def invalidate(self, key: K) -> None:
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.weight -= entry[2]
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.weight = 0
+
+
+class ScoreCache:
+    """Cache the rerank scores of the (query, doc) pairs.
+
+    The key is the model name, the query text and the hash of the doc text, only
+    the uncached docs are sent to the `score` function.
+
+    Args:
+        name: the `cache` label of the Prometheus metrics.
+        model_name: the model of the scores.
+        max_size: the max number of entries, `0` disables the cache.
+        ttl: seconds before an entry expires, `0` means never.
+    """
+
+    def __init__(self, name: str, model_name: str, max_size: int, ttl: float = 0):
+        self.model_name = model_name
+        self.cache: LRUCache[tuple[str, str, bytes], float] = LRUCache(
+            name, max_size, ttl
+        )
+
+    def keys(self, query: str, docs: list[str]) -> list[tuple[str, str, bytes]]:
+        return [
+            (self.model_name, query, blake2b(doc.encode(), digest_size=16).digest())
+            for doc in docs
+        ]
+
+    def lookup(self, keys: list[tuple[str, str, bytes]]) -> list[float | None]:
+        return [self.cache.get(key) for key in keys]
+
+    def fill(
+        self,
+        keys: list[tuple[str, str, bytes]],
+        scores: list[float | None],
+        missing: list[int],
+        missing_scores: list[float],
+    ) -> list[float]:
+        for i, score in zip(missing, missing_scores):
+            scores[i] = score
+            self.cache.put(keys[i], score)
+        return scores
+
+    def score(
+        self, query: str, docs: list[str], func: Callable[[str, list[str]], list[float]]
+    ) -> list[float]:
+        if not self.cache.enabled:
+            return func(query, docs)
+        keys = self.keys(query, docs)
+        scores = self.lookup(keys)
+        missing = [i for i, score in enumerate(scores) if score is None]
+        if not missing:
+            return scores
+        return self.fill(keys, scores, missing, func(query, [docs[i] for i in missing]))
+
+    async def ascore(
+        self,
+        query: str,
+        docs: list[str],
+        func: Callable[[str, list[str]], Awaitable[list[float]]],
+    ) -> list[float]:
+        if not self.cache.enabled:
+            return await func(query, docs)
+        keys = self.keys(query, docs)
+        scores = self.lookup(keys)
+        missing = [i for i, score in enumerate(scores) if score is None]
+        if not missing:
+            return scores
+        missing_scores = await func(query, [docs[i] for i in missing])
+        return self.fill(keys, scores, missing, missing_scores)
+
+
+class SemanticCache(Generic[V]):
+    """Reuse the value of a previous query whose vector is similar enough.
+
+    The unit query vectors are grouped by the namespace and the rest of the scope
+    (everything else that changes the result, like the limit and the filter). A lookup is a
+    matrix-vector product over the vectors in the same scope. The entries are
+    evicted in LRU order across all the scopes, and all the entries of a namespace
+    are dropped once a newer namespace version is seen.
+
+    Args:
+        name: the `cache` label of the Prometheus metrics.
+        max_size: the max number of entries, `0` disables the cache.
+        threshold: the min cosine similarity to reuse a cached value.
+    """
+
+    def __init__(self, name: str, max_size: int, threshold: float) -> None:
+        self.name = name
+        self.max_size = max_size
+        self.threshold = threshold
+        # (namespace, scope) -> entry id -> (unit vector, value)
+        self.buckets: dict[tuple[str, Hashable], dict[int, tuple[np.ndarray, V]]] = {}
+        # (namespace, scope) -> (entry ids, stacked unit vectors), built lazily
+        self.matrices: dict[tuple[str, Hashable], tuple[list[int], np.ndarray]] = {}
+        self.lru: OrderedDict[int, tuple[str, Hashable]] = OrderedDict()
+        self.versions: dict[str, int] = {}
+        self.next_id = 0
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.lru)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    @staticmethod
+    def normalize(vector) -> np.ndarray | None:
+        unit = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(unit)
+        if norm == 0:
+            return None
+        return unit / norm
+
+    def check_version(self, namespace: str, version: int) -> bool:
+        """Drop the namespace if it has been written, `False` for a stale version."""
+        current = self.versions.get(namespace)
+        if current is not None and version < current:
+            return False
+        if current is not None and version > current:
+            for key in [key for key in self.buckets if key[0] == namespace]:
+                for entry_id in self.buckets.pop(key):
+                    del self.lru[entry_id]
+                self.matrices.pop(key, None)
+        self.versions[namespace] = version
+        return True
+
+    def get(self, scope: SemanticScope, vector) -> V | None:
+        if not self.enabled:
+            return None
+        namespace, version, _ = scope
+        unit = self.normalize(vector)
+        key = (namespace, scope[2])
+        value = None
+        with self.lock:
+            if unit is not None and self.check_version(namespace, version):
+                bucket = self.buckets.get(key)
+                if bucket:
+                    if key not in self.matrices:
+                        ids = list(bucket)
+                        self.matrices[key] = (
+                            ids,
+                            np.stack([bucket[entry_id][0] for entry_id in ids]),
+                        )
+                    ids, matrix = self.matrices[key]
+                    similarity = matrix @ unit
+                    best = int(np.argmax(similarity))
+                    if similarity[best] >= self.threshold:
+                        self.lru.move_to_end(ids[best])
+                        value = bucket[ids[best]][1]
+        cache_counter.labels(self.name, "miss" if value is None else "hit").inc()
+        return value
+
+    def put(self, scope: SemanticScope, vector, value: V) -> None:
+        if not self.enabled:
+            return
+        namespace, version, _ = scope
+        unit = self.normalize(vector)
+        if unit is None:
+            return
+        key = (namespace, scope[2])
+        evicted = 0
+        with self.lock:
+            if not self.check_version(namespace, version):
+                return
+            entry_id = self.next_id
+            self.next_id += 1
+            self.buckets.setdefault(key, {})[entry_id] = (unit, value)
+            self.matrices.pop(key, None)
+            self.lru[entry_id] = key
+            while len(self.lru) > self.max_size:
+                old_id, old_key = self.lru.popitem(last=False)
+                bucket = self.buckets[old_key]
+                del bucket[old_id]
+                if not bucket:
+                    del self.buckets[old_key]
+                self.matrices.pop(old_key, None)
+                evicted += 1
+        if evicted:
+            cache_counter.labels(self.name, "eviction").inc(evicted)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.buckets.clear()
+            self.matrices.clear()
+            self.lru.clear()
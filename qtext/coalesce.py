@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import asyncio
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Awaitable, Callable, Generic, TypeVar
+
+from qtext.metrics import coalesce_histogram
+from qtext.utils import take_batch
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+def check_results(name: str, batch: list, results: list):
+    """Every caller must get a result, or the unresolved ones would wait forever."""
+    if len(results) != len(batch):
+        raise ValueError(f"{name} returned {len(results)} results for {len(batch)}")
+
+
+class Coalescer(Generic[T, R]):
+    """Merge the concurrent single calls into batched calls.
+
+    The calls arriving within `window` seconds (or up to `max_batch` of them) are
+    sent with one `func` call, which must return one result for each item. Up to
+    `max_inflight` batches are sent at the same time. The circuit breaker should
+    wrap the `func`, so a failed batch counts as one failure.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        name: str,
+        func: Callable[[list[T]], list[R]],
+        window: float,
+        max_batch: int,
+        max_inflight: int = 4,
+    ) -> None:
+        self.name = name
+        self.func = func
+        self.window = window
+        self.max_batch = max_batch
+        self.queue: queue.Queue[tuple[T, Future]] = queue.Queue()
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_inflight, thread_name_prefix=f"qtext-{name}"
+        )
+        self.dispatcher = threading.Thread(
+            target=self.dispatch, name=f"qtext-{name}-coalescer", daemon=True
+        )
+        self.dispatcher.start()
+
+    def __call__(self, item: T, timeout: float | None = None) -> R:
+        """Wait at most `timeout` seconds, the batch itself keeps the client timeout."""
+        future: Future[R] = Future()
+        self.queue.put((item, future))
+        return future.result(timeout)
+
+    def dispatch(self):
+        while True:
+            batch = take_batch(self.queue, self.max_batch, self.window)
+            self.executor.submit(self.run, batch)
+
+    def run(self, batch: list[tuple[T, Future]]):
+        coalesce_histogram.labels(self.name).observe(len(batch))
+        try:
+            results = self.func([item for (item, _) in batch])
+            check_results(self.name, batch, results)
+        except Exception as err:
+            for _, future in batch:
+                future.set_exception(err)
+            return
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+
+class AsyncCoalescer(Generic[T, R]):
+    """The asyncio version of the `Coalescer`, all the calls share the event loop."""
+
+    def __init__(
+        self,
+        name: str,
+        func: Callable[[list[T]], Awaitable[list[R]]],
+        window: float,
+        max_batch: int,
+    ) -> None:
+        self.name = name
+        self.func = func
+        self.window = window
+        self.max_batch = max_batch
+        self.pending: list[tuple[T, asyncio.Future]] = []
+        self.timer: asyncio.TimerHandle | None = None
+        # keep a reference to the running batches, or they may be garbage collected
+        self.tasks: set[asyncio.Task] = set()
+
+    async def __call__(self, item: T) -> R:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((item, future))
+        if len(self.pending) >= self.max_batch:
+            self.flush()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.window, self.flush)
+        return await future
+
+    def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch, self.pending = self.pending, []
+        if batch:
+            task = asyncio.ensure_future(self.run(batch))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def run(self, batch: list[tuple[T, asyncio.Future]]):
+        coalesce_histogram.labels(self.name).observe(len(batch))
+        try:
+            results = await self.func([item for (item, _) in batch])
+            check_results(self.name, batch, results)
+        except Exception as err:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(err)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
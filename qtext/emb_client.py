@@ -7,10 +7,23 @@ import openai
 
 from qtext.log import logger
 from qtext.metrics import embedding_histogram, sparse_histogram
-from qtext.spec import SparseEmbedding
+from qtext.spec import SparseArray
 from qtext.utils import time_it
 
 
+class SparseEmbeddingResponse(msgspec.Struct, kw_only=True):
+    dim: int
+    indices: list[int]
+    values: list[float]
+
+    def to_array(self) -> SparseArray:
+        return SparseArray(self.dim, self.indices, self.values)
+
+
+def by_index(data) -> int:
+    return data.index
+
+
 class EmbeddingClient:
     def __init__(self, model_name: str, api_key: str, endpoint: str, timeout: int):
         self.model_name = model_name
@@ -22,15 +35,28 @@ class EmbeddingClient:
 
     @time_it
     @embedding_histogram.time()
-    def embedding(self, text: str | list[str]) -> list[float]:
+    def embedding(
+        self, text: str | list[str], timeout: float | None = None
+    ) -> list[float]:
         response = self.client.embeddings.create(
             model=self.model_name,
             input=text,
+            timeout=openai.NOT_GIVEN if timeout is None else timeout,
         )
         if len(response.data) > 1:
             return [data.embedding for data in response.data]
         return response.data[0].embedding
 
+    @time_it
+    @embedding_histogram.time()
+    def embeddings(self, texts: list[str]) -> list[list[float]]:
+        """Embed a batch of texts, the result always has one vector for each text."""
+        response = self.client.embeddings.create(
+            model=self.model_name,
+            input=texts,
+        )
+        return [data.embedding for data in sorted(response.data, key=by_index)]
+
 
 class CohereEmbeddingClient:
     def __init__(self, model_name: str, api_key: str):
@@ -39,23 +65,46 @@ class CohereEmbeddingClient:
 
     @time_it
     @embedding_histogram.time()
-    def embedding(self, text: str) -> list[float]:
+    def embedding(self, text: str, timeout: float | None = None) -> list[float]:
+        """The Cohere client has no per-call `timeout`, it's ignored."""
         response = self.client.embed([text], model=self.model_name)
         return response.embeddings[0]
 
+    @time_it
+    @embedding_histogram.time()
+    def embeddings(self, texts: list[str]) -> list[list[float]]:
+        response = self.client.embed(texts, model=self.model_name)
+        return response.embeddings
+
 
 class SparseEmbeddingClient:
     def __init__(self, endpoint: str, dim: int, timeout: int) -> None:
         self.dim = dim
         self.client = httpx.Client(base_url=endpoint, timeout=timeout)
-        self.decoder = msgspec.json.Decoder(type=list[SparseEmbedding])
+        self.decoder = msgspec.json.Decoder(type=list[SparseEmbeddingResponse])
 
     @time_it
-    @sparse_histogram.time()
     def sparse_embedding(
-        self, text: str | list[str]
-    ) -> list[SparseEmbedding] | SparseEmbedding:
-        resp = self.client.post("/inference", json=text)
+        self, text: str | list[str], timeout: float | None = None
+    ) -> list[SparseArray] | SparseArray:
+        sparse = self.sparse_embeddings(text, timeout)
+        if len(sparse) == 1:
+            return sparse[0]
+        return sparse
+
+    @sparse_histogram.time()
+    def sparse_embeddings(
+        self, texts: str | list[str], timeout: float | None = None
+    ) -> list[SparseArray]:
+        """Embed a batch of texts, the result always has one vector for each text.
+
+        The `timeout` overrides the client timeout of this call.
+        """
+        resp = self.client.post(
+            "/inference",
+            json=texts,
+            timeout=httpx.USE_CLIENT_DEFAULT if timeout is None else timeout,
+        )
         if resp.is_error:
             logger.info(
                 "failed to call sparse embedding [%d]: %s",
@@ -63,8 +112,80 @@ class SparseEmbeddingClient:
                 resp.content,
             )
             resp.raise_for_status()
-        sparse = self.decoder.decode(resp.content)
+        return [emb.to_array() for emb in self.decoder.decode(resp.content)]
+
 
+class AsyncEmbeddingClient:
+    def __init__(self, model_name: str, api_key: str, endpoint: str, timeout: int):
+        self.model_name = model_name
+        self.client = openai.AsyncClient(
+            api_key=api_key,
+            base_url=endpoint or None,
+            timeout=timeout,
+        )
+
+    @time_it
+    async def embedding(self, text: str | list[str]) -> list[float]:
+        with embedding_histogram.time():
+            response = await self.client.embeddings.create(
+                model=self.model_name,
+                input=text,
+            )
+        if len(response.data) > 1:
+            return [data.embedding for data in response.data]
+        return response.data[0].embedding
+
+    @time_it
+    async def embeddings(self, texts: list[str]) -> list[list[float]]:
+        with embedding_histogram.time():
+            response = await self.client.embeddings.create(
+                model=self.model_name,
+                input=texts,
+            )
+        return [data.embedding for data in sorted(response.data, key=by_index)]
+
+
+class AsyncCohereEmbeddingClient:
+    def __init__(self, model_name: str, api_key: str):
+        self.client = cohere.AsyncClient(api_key=api_key)
+        self.model_name = model_name
+
+    @time_it
+    async def embedding(self, text: str) -> list[float]:
+        with embedding_histogram.time():
+            response = await self.client.embed([text], model=self.model_name)
+        return response.embeddings[0]
+
+    @time_it
+    async def embeddings(self, texts: list[str]) -> list[list[float]]:
+        with embedding_histogram.time():
+            response = await self.client.embed(texts, model=self.model_name)
+        return response.embeddings
+
+
+class AsyncSparseEmbeddingClient:
+    def __init__(self, endpoint: str, dim: int, timeout: int) -> None:
+        self.dim = dim
+        self.client = httpx.AsyncClient(base_url=endpoint, timeout=timeout)
+        self.decoder = msgspec.json.Decoder(type=list[SparseEmbeddingResponse])
+
+    @time_it
+    async def sparse_embedding(
+        self, text: str | list[str]
+    ) -> list[SparseArray] | SparseArray:
+        sparse = await self.sparse_embeddings(text)
         if len(sparse) == 1:
             return sparse[0]
         return sparse
+
+    async def sparse_embeddings(self, texts: str | list[str]) -> list[SparseArray]:
+        with sparse_histogram.time():
+            resp = await self.client.post("/inference", json=texts)
+        if resp.is_error:
+            logger.info(
+                "failed to call sparse embedding [%d]: %s",
+                resp.status_code,
+                resp.content,
+            )
+            resp.raise_for_status()
+        return [emb.to_array() for emb in self.decoder.decode(resp.content)]
@@ -1,7 +1,18 @@
 from __future__ import annotations
 
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from functools import partial
 from time import perf_counter
+from typing import Any
 
+import httpx
+import msgspec
+import openai
+
+from qtext.breaker import CircuitBreaker, CircuitOpenError
+from qtext.cache import LRUCache, SemanticCache, SemanticScope, normalize_query
+from qtext.coalesce import Coalescer
 from qtext.config import Config
 from qtext.emb_client import (
     CohereEmbeddingClient,
@@ -9,25 +20,58 @@ from qtext.emb_client import (
     SparseEmbeddingClient,
 )
 from qtext.highlight_client import ENGLISH_STOPWORDS, HighlightClient
-from qtext.metrics import rerank_histogram
-from qtext.pg_client import PgVectorsClient
+from qtext.ingest import IngestQueue
+from qtext.log import logger
+from qtext.metrics import degrade_counter, rerank_histogram
+from qtext.pg_client import NamespaceVersions, PgVectorsClient
+from qtext.ranker import RRFRanker
 from qtext.schema import DefaultTable, Querier
 from qtext.spec import (
     AddNamespaceRequest,
     HighlightRequest,
     HighlightResponse,
+    HighlightScore,
     QueryDocRequest,
     QueryExplainResponse,
+    Record,
+    SparseArray,
+)
+from qtext.utils import (
+    BoundedExecutor,
+    Deadline,
+    DeadlineExceededError,
+    batched,
+    msgspec_encode_np,
+    time_it,
+    timed,
+)
+
+LegResult = tuple[list[DefaultTable], float]
+ResultKey = tuple[str, int, bytes]
+# the ranked docs and the steps skipped by the deadline
+SearchResult = tuple[list[DefaultTable], list[str]]
+TIMEOUT_ERRORS = (
+    TimeoutError,
+    FutureTimeoutError,
+    httpx.TimeoutException,
+    openai.APITimeoutError,
 )
-from qtext.utils import time_it
+# a call that fails with these is skipped like a late one
+UNAVAILABLE_ERRORS = (CircuitOpenError, *TIMEOUT_ERRORS)
+# each dependency has its own threads, a slow one cannot block the others
+POOLS = ("text", "vector", "sparse", "rank")
 
 
 class RetrievalEngine:
     def __init__(self, config: Config) -> None:
-        self.querier = Querier(config.vector_store.schema)
+        self.ranker = config.ranker.ranker(**config.ranker.params)
+        self.querier = Querier(
+            config.vector_store.schema,
+            required_fields=getattr(self.ranker, "required_fields", None),
+        )
         self.req_cls = self.querier.generate_request_class()
         self.resp_cls = self.querier.table_type
-        self.pg_client = PgVectorsClient(config.vector_store.url, querier=self.querier)
+        self.pg_client = PgVectorsClient(config.vector_store, querier=self.querier)
         self.highlight_client = HighlightClient(config.highlight.addr)
         if config.embedding.client == "openai":
             self.emb_client = EmbeddingClient(
@@ -46,7 +90,93 @@ class RetrievalEngine:
             dim=config.sparse.dim,
             timeout=config.sparse.timeout,
         )
-        self.ranker = config.ranker.ranker(**config.ranker.params)
+        self.emb_breaker = CircuitBreaker("embedding", config.breaker)
+        self.sparse_breaker = CircuitBreaker("sparse", config.breaker)
+        # `embed_query(text, budget)`, a coalesced batch goes through the breaker once
+        if config.embedding.coalesce_window > 0:
+            coalescer = Coalescer(
+                "embedding",
+                partial(self.emb_breaker.call, self.emb_client.embeddings),
+                config.embedding.coalesce_window,
+                config.embedding.coalesce_max_batch,
+            )
+            self.embed_query = partial(
+                call_with_budget, coalescer, timeout=config.embedding.timeout
+            )
+        else:
+            self.embed_query = partial(
+                self.emb_breaker.call,
+                call_with_budget,
+                self.emb_client.embedding,
+                timeout=config.embedding.timeout,
+            )
+        if config.sparse.coalesce_window > 0:
+            coalescer = Coalescer(
+                "sparse",
+                partial(self.sparse_breaker.call, self.sparse_client.sparse_embeddings),
+                config.sparse.coalesce_window,
+                config.sparse.coalesce_max_batch,
+            )
+            self.embed_sparse_query = partial(
+                call_with_budget, coalescer, timeout=config.sparse.timeout
+            )
+        else:
+            self.embed_sparse_query = partial(
+                self.sparse_breaker.call,
+                call_with_budget,
+                self.sparse_client.sparse_embedding,
+                timeout=config.sparse.timeout,
+            )
+        self.highlight_breaker = CircuitBreaker("highlight", config.breaker)
+        self.rank_breaker = CircuitBreaker("rank", config.breaker)
+        self.emb_cache: LRUCache[tuple[str, str], list[float]] = LRUCache(
+            "embedding", config.embedding.cache_size, config.embedding.cache_ttl
+        )
+        self.sparse_cache: LRUCache[tuple[str, str], SparseArray] = LRUCache(
+            "sparse", config.sparse.cache_size, config.sparse.cache_ttl
+        )
+        self.sparse_model = config.sparse.addr
+        self.emb_batch_size = config.embedding.batch_size
+        self.sparse_batch_size = config.sparse.batch_size
+        self.result_cache: LRUCache[ResultKey, bytes] = LRUCache(
+            "result",
+            config.query.result_cache_size,
+            config.query.result_cache_ttl,
+            weigher=len,
+            max_weight=config.query.result_cache_max_bytes,
+        )
+        self.semantic_cache: SemanticCache[list[DefaultTable]] = SemanticCache(
+            "semantic",
+            config.query.semantic_cache_size,
+            config.query.semantic_cache_threshold,
+        )
+        self.hybrid_sql = config.query.hybrid_sql
+        if self.hybrid_sql and self.querier.primary_key is None:
+            logger.warning("hybrid SQL is disabled since the schema has no primary key")
+            self.hybrid_sql = False
+        self.ingest_queue: IngestQueue | None = None
+        if config.ingest.enabled:
+            self.ingest_queue = IngestQueue(config.ingest, self.add_docs)
+        self.default_deadline = config.query.deadline
+        self.pools: dict[str, BoundedExecutor] | None = None
+        # the bulk embedding has its own threads, the writes cannot starve the reads
+        self.embed_executor: ThreadPoolExecutor | None = None
+        if config.query.concurrent or self.default_deadline > 0:
+            self.pools = {
+                name: BoundedExecutor(name, config.query.max_workers) for name in POOLS
+            }
+            self.embed_executor = ThreadPoolExecutor(
+                max_workers=config.query.max_workers,
+                thread_name_prefix="qtext-embed",
+            )
+            if self.pg_client.pool is None:
+                logger.warning(
+                    "the retrieval legs share one postgres connection and run one "
+                    "at a time, set `pool_max_size` to run them concurrently"
+                )
+
+    def result_key(self, req: QueryDocRequest) -> ResultKey:
+        return result_key(self.pg_client.versions, req)
 
     @time_it
     def add_namespace(self, req: AddNamespaceRequest) -> None:
@@ -54,105 +184,454 @@ class RetrievalEngine:
 
     @time_it
     def add_doc(self, req) -> None:
+        self.fill_embeddings(req)
+        self.pg_client.add_doc(req)
+
+    @time_it
+    def add_docs(self, reqs: list) -> None:
+        self.fill_embeddings_batch(reqs)
+        self.pg_client.add_docs(reqs)
+
+    def fill_vectors(self, reqs: list) -> None:
+        missing = [req for req in reqs if not self.querier.retrieve_vector(req)]
+        for batch in batched(missing, self.emb_batch_size):
+            vectors = self.emb_breaker.call(
+                self.emb_client.embeddings,
+                [self.querier.retrieve_text(req) for req in batch],
+            )
+            for req, vector in zip(batch, vectors):
+                self.querier.fill_vector(req, vector)
+
+    def fill_sparse_vectors(self, reqs: list) -> None:
+        missing = [req for req in reqs if not self.querier.retrieve_sparse_vector(req)]
+        for batch in batched(missing, self.sparse_batch_size):
+            sparse = self.sparse_breaker.call(
+                self.sparse_client.sparse_embeddings,
+                [self.querier.retrieve_text(req) for req in batch],
+            )
+            for req, vector in zip(batch, sparse):
+                self.querier.fill_sparse_vector(req, vector)
+
+    def fill_embeddings_batch(self, reqs: list) -> None:
+        """Generate the vectors that are not provided by the user in batches.
+
+        The dense and sparse embeddings run concurrently with the embed executor,
+        the query pools are left to the reads.
+        """
+        if not self.querier.has_text_index():
+            return
+        tasks = []
+        if self.querier.has_vector_index():
+            tasks.append(self.fill_vectors)
+        if self.querier.has_sparse_index():
+            tasks.append(self.fill_sparse_vectors)
+        if self.embed_executor is None:
+            for task in tasks:
+                task(reqs)
+            return
+        for future in [self.embed_executor.submit(task, reqs) for task in tasks]:
+            future.result()
+
+    def fill_embeddings(self, req) -> None:
+        """Generate the vectors that are not provided by the user."""
         if self.querier.has_vector_index():
             vector = self.querier.retrieve_vector(req)
             if not vector and self.querier.has_text_index():
                 text = self.querier.retrieve_text(req)
-                self.querier.fill_vector(req, self.emb_client.embedding(text=text))
+                self.querier.fill_vector(
+                    req, self.emb_breaker.call(self.emb_client.embedding, text)
+                )
         if self.querier.has_sparse_index():
             sparse = self.querier.retrieve_sparse_vector(req)
             if not sparse and self.querier.has_text_index():
                 text = self.querier.retrieve_text(req)
                 self.querier.fill_sparse_vector(
-                    req, self.sparse_client.sparse_embedding(text=text)
+                    req,
+                    self.sparse_breaker.call(self.sparse_client.sparse_embedding, text),
                 )
-        self.pg_client.add_doc(req)
 
     @time_it
     @rerank_histogram.time()
-    def rank(
-        self,
-        req: QueryDocRequest,
-        text_res: list[DefaultTable],
-        vector_res: list[DefaultTable],
-        sparse_res: list[DefaultTable],
-    ) -> list[DefaultTable]:
-        docs = self.querier.combine_vector_text(
-            vec_res=vector_res, sparse_res=sparse_res, text_res=text_res
-        )
-        ranked = self.ranker.rank(req.to_record(), docs)
+    def rank(self, req: QueryDocRequest, docs: list[Record]) -> list[DefaultTable]:
+        """Rank the docs, only the remote rankers go through the circuit breaker."""
+        if is_remote(self.ranker):
+            ranked = self.rank_breaker.call(self.ranker.rank, req.to_record(), docs)
+        else:
+            ranked = self.ranker.rank(req.to_record(), docs)
         return [DefaultTable.from_record(record) for record in ranked]
 
-    @time_it
-    def query(self, req: QueryDocRequest) -> list[DefaultTable]:
-        kw_results = self.pg_client.query_text(req)
-        if self.querier.has_vector_index() and not req.vector:
-            req.vector = self.emb_client.embedding(req.query)
-        if self.querier.has_sparse_index() and not req.sparse_vector:
-            req.sparse_vector = self.sparse_client.sparse_embedding(req.query)
-        vec_results = self.pg_client.query_vector(req)
-        sparse_results = self.pg_client.query_sparse_vector(req)
-        return self.rank(req, kw_results, vec_results, sparse_results)
+    def query_embedding(self, query: str, timeout: float | None = None) -> list[float]:
+        """Embed the query, the same normalized text is served from the cache."""
+        key = (self.emb_client.model_name, normalize_query(query))
+        vector = self.emb_cache.get(key)
+        if vector is None:
+            vector = self.embed_query(key[1], timeout)
+            self.emb_cache.put(key, vector)
+        return vector
 
-    @time_it
-    def query_explain(self, req: QueryDocRequest) -> QueryExplainResponse:
+    def query_sparse_embedding(
+        self, query: str, timeout: float | None = None
+    ) -> SparseArray:
+        key = (self.sparse_model, normalize_query(query))
+        sparse = self.sparse_cache.get(key)
+        if sparse is None:
+            sparse = self.embed_sparse_query(key[1], timeout)
+            self.sparse_cache.put(key, sparse)
+        return sparse
+
+    def fill_query_vector(
+        self, req: QueryDocRequest, deadline: Deadline | None = None
+    ) -> None:
         if self.querier.has_vector_index() and not req.vector:
-            req.vector = self.emb_client.embedding(req.query)
+            timeout = deadline and deadline.remaining()
+            req.vector = self.query_embedding(req.query, timeout)
+
+    def fill_query_sparse_vector(
+        self, req: QueryDocRequest, deadline: Deadline | None = None
+    ) -> None:
         if self.querier.has_sparse_index() and not req.sparse_vector:
-            req.sparse_vector = self.sparse_client.sparse_embedding(req.query)
+            timeout = deadline and deadline.remaining()
+            req.sparse_vector = self.query_sparse_embedding(req.query, timeout)
 
-        explain = QueryExplainResponse()
+    # the legs pass the remaining time as the timeout of each call, so the late
+    # calls stop instead of holding the threads
+
+    def text_leg(self, req: QueryDocRequest, deadline: Deadline) -> LegResult:
+        return timed(self.pg_client.query_text, req, deadline.remaining())
+
+    def vector_leg(self, req: QueryDocRequest, deadline: Deadline) -> LegResult:
+        self.fill_query_vector(req, deadline)
+        return timed(self.pg_client.query_vector, req, deadline.remaining())
+
+    def sparse_leg(self, req: QueryDocRequest, deadline: Deadline) -> LegResult:
+        self.fill_query_sparse_vector(req, deadline)
+        return timed(self.pg_client.query_sparse_vector, req, deadline.remaining())
 
-        vec_time = perf_counter()
-        vec_results = self.pg_client.query_vector(req)
-        explain.vector.elapsed = perf_counter() - vec_time
-        explain.vector.docs = [vec.to_record().simplify() for vec in vec_results]
+    def deadline(self, req: QueryDocRequest) -> Deadline:
+        return Deadline(req.deadline or self.default_deadline)
 
-        sparse_time = perf_counter()
-        sparse_results = self.pg_client.query_sparse_vector(req)
-        explain.sparse.elapsed = perf_counter() - sparse_time
-        explain.sparse.docs = [
-            sparse.to_record().simplify() for sparse in sparse_results
+    def submit(self, pool: str, deadline: Deadline, func, *args) -> Future | None:
+        """Run the `func` in its pool, return `None` if it should be skipped.
+
+        Without a deadline, the call runs in this thread if the pool is busy.
+        """
+        future = self.pools[pool].submit(func, *args)
+        if future is None and deadline.end is None:
+            future = Future()
+            try:
+                future.set_result(func(*args))
+            except Exception as err:
+                future.set_exception(err)
+        return future
+
+    def within(self, deadline: Deadline, pool: str, func, *args) -> tuple[bool, Any]:
+        """Call the `func`, return `(False, None)` if it's late or unavailable.
+
+        The call is unavailable if its circuit breaker is open, its pool is busy, or
+        it times out. The late call is left running in its pool until its own
+        timeout, its result is dropped. Without the pools, the deadline is only
+        checked before the call.
+        """
+        try:
+            if deadline.expired():
+                return False, None
+            if deadline.end is None or self.pools is None:
+                return True, func(*args)
+            future = self.submit(pool, deadline, func, *args)
+            if future is None:
+                return False, None
+            done, _ = wait([future], timeout=deadline.remaining())
+            if not done:
+                future.cancel()
+                return False, None
+            return True, future.result()
+        except UNAVAILABLE_ERRORS:
+            return False, None
+
+    def retrieve(
+        self, req: QueryDocRequest, deadline: Deadline | None = None
+    ) -> tuple[dict[str, LegResult], list[str]]:
+        """Run the text, vector and sparse retrieval.
+
+        With the pools, the full-text search starts at once while the query is
+        embedded, and each vector leg queries postgres as soon as its embedding is
+        ready. The elapsed time of each leg doesn't include the embedding.
+
+        The legs that cannot finish before the deadline, whose pool is busy, or
+        depend on an open circuit are skipped with empty results, their names are
+        returned with the results.
+        """
+        deadline = deadline or Deadline()
+        legs = {
+            "text": self.text_leg,
+            "vector": self.vector_leg,
+            "sparse": self.sparse_leg,
+        }
+        results: dict[str, LegResult] = {}
+        skipped: list[str] = []
+        if self.pools is None:
+            for name, leg in legs.items():
+                if deadline.expired():
+                    skipped.append(name)
+                    continue
+                try:
+                    results[name] = leg(req, deadline)
+                except UNAVAILABLE_ERRORS:
+                    skipped.append(name)
+        else:
+            futures = {
+                name: self.submit(name, deadline, leg, req, deadline)
+                for name, leg in legs.items()
+            }
+            done, _ = wait(
+                [future for future in futures.values() if future is not None],
+                timeout=deadline.remaining(),
+            )
+            for name, future in futures.items():
+                if future not in done:
+                    if future is not None:
+                        future.cancel()
+                    skipped.append(name)
+                    continue
+                try:
+                    results[name] = future.result()
+                except UNAVAILABLE_ERRORS:
+                    skipped.append(name)
+        for name in skipped:
+            results[name] = ([], 0.0)
+            degrade_counter.labels(name).inc()
+        return results, skipped
+
+    def retrieve_hybrid(
+        self, req: QueryDocRequest, deadline: Deadline | None = None
+    ) -> list[Record] | None:
+        """Retrieve from all the indexes with one SQL statement.
+
+        Return `None` if it cannot finish before the deadline, or an embedding
+        service is unavailable, the caller degrades to the skipped result like the
+        async engine.
+        """
+        deadline = deadline or Deadline()
+        try:
+            if not self.fill_hybrid_vectors(req, deadline):
+                return None
+            rows = self.pg_client.query_hybrid(req, deadline.remaining())
+        except UNAVAILABLE_ERRORS:
+            return None
+        return self.querier.combine_hybrid(rows)
+
+    def fill_hybrid_vectors(self, req: QueryDocRequest, deadline: Deadline) -> bool:
+        """Embed the query for the hybrid SQL, return `False` if it's late."""
+        if self.pools is None:
+            if deadline.expired():
+                return False
+            self.fill_query_vector(req, deadline)
+            self.fill_query_sparse_vector(req, deadline)
+            return True
+        futures = [
+            self.submit("vector", deadline, self.fill_query_vector, req, deadline),
+            self.submit(
+                "sparse", deadline, self.fill_query_sparse_vector, req, deadline
+            ),
         ]
+        if None in futures:
+            return False
+        done, _ = wait(futures, timeout=deadline.remaining())
+        if len(done) < len(futures):
+            for future in futures:
+                future.cancel()
+            return False
+        for future in futures:
+            future.result()
+        return True
 
-        text_time = perf_counter()
-        text_results = self.pg_client.query_text(req)
-        explain.text.elapsed = perf_counter() - text_time
-        explain.text.docs = [text.to_record().simplify() for text in text_results]
+    def rank_within(
+        self, req: QueryDocRequest, docs: list[Record], deadline: Deadline
+    ) -> tuple[list[DefaultTable], bool]:
+        """Rank the docs, or return the unranked fusion if it's late or unavailable.
+
+        The cheap (inline) rankers always run in this thread.
+        """
+        if is_inline(self.ranker):
+            return self.rank(req, docs), True
+        reranked, ranked = self.within(deadline, "rank", self.rank, req, docs)
+        if not reranked:
+            degrade_counter.labels("rank").inc()
+            return unranked(req, docs), False
+        return ranked, True
+
+    @time_it
+    def query(self, req: QueryDocRequest) -> list[DefaultTable]:
+        return self.search(req)[0]
+
+    def search(self, req: QueryDocRequest) -> SearchResult:
+        """Query the docs, also return the skipped steps."""
+        deadline = self.deadline(req)
+        if not self.semantic_cache.enabled or not self.querier.has_vector_index():
+            return self.retrieve_and_rank(req, deadline)
+
+        scope = semantic_scope(self.pg_client.versions, req)
+        embedded, _ = self.within(
+            deadline, "vector", self.fill_query_vector, req, deadline
+        )
+        if not embedded:
+            return self.retrieve_and_rank(req, deadline)
+        docs = self.semantic_cache.get(scope, req.vector)
+        if docs is not None:
+            return docs, []
+        docs, skipped = self.retrieve_and_rank(req, deadline)
+        if not skipped:
+            self.semantic_cache.put(scope, req.vector, docs)
+        return docs, skipped
+
+    def retrieve_and_rank(
+        self, req: QueryDocRequest, deadline: Deadline
+    ) -> SearchResult:
+        # an unavailable embedding service skips its leg instead of the statement
+        docs, skipped = None, []
+        if self.hybrid_sql and self.emb_breaker.closed and self.sparse_breaker.closed:
+            docs = self.retrieve_hybrid(req, deadline)
+            if docs is None:
+                # the separate legs still serve the text search in the time left
+                degrade_counter.labels("hybrid").inc()
+                skipped = ["hybrid"]
+        if docs is None:
+            results, skipped_legs = self.retrieve(req, deadline)
+            docs = combine(self.querier, results)
+            skipped.extend(skipped_legs)
+        ranked, reranked = self.rank_within(req, docs, deadline)
+        if not reranked:
+            skipped.append("rank")
+        return ranked, skipped
+
+    @time_it
+    def query_explain(self, req: QueryDocRequest) -> QueryExplainResponse:
+        deadline = self.deadline(req)
+        results, skipped = self.retrieve(req, deadline)
+        explain = QueryExplainResponse()
+        for name, retrieved in (
+            ("vector", explain.vector),
+            ("sparse", explain.sparse),
+            ("text", explain.text),
+        ):
+            docs, retrieved.elapsed = results[name]
+            retrieved.docs = [doc.to_record().simplify() for doc in docs]
 
         rank_time = perf_counter()
-        ranked = self.rank(req, text_results, vec_results, sparse_results)
+        ranked, reranked = self.rank_within(
+            req, combine(self.querier, results), deadline
+        )
         explain.ranked.elapsed = perf_counter() - rank_time
         explain.ranked.docs = [rank.to_record().simplify() for rank in ranked]
         explain.ranked.fill_hybrid_ids(explain.vector, explain.sparse, explain.text)
+        explain.skipped = skipped if reranked else [*skipped, "rank"]
         return explain
 
     @time_it
     def highlight(self, req: HighlightRequest) -> HighlightResponse:
-        text_scores = self.highlight_client.highlight_score(req.query, req.docs)
-        highlighted = []
-        for text_score in text_scores:
-            words = []
-            highlight_index = set()
-            index = -1
-            for word in text_score:
-                if word.text.startswith("##"):
-                    words[-1] += word.text[2:]
-                    if word.score >= req.threshold:
-                        highlight_index.add(index)
-                    continue
+        text_scores = self.highlight_breaker.call(
+            self.highlight_client.highlight_score, req.query, req.docs
+        )
+        return render_highlight(req, text_scores)
 
-                words.append(word.text)
-                index += 1
-                if req.ignore_stopwords and word.text.lower() in ENGLISH_STOPWORDS:
-                    continue
+
+def result_key(versions: NamespaceVersions, req: QueryDocRequest) -> ResultKey:
+    """The result cache key, this should be called before filling the embeddings.
+
+    The version is read before the query runs, so a result that races with a write
+    is stored under the old version and never served.
+    """
+    return (
+        req.namespace,
+        versions.get(req.namespace),
+        msgspec.msgpack.encode(req, enc_hook=msgspec_encode_np),
+    )
+
+
+def semantic_scope(versions: NamespaceVersions, req: QueryDocRequest) -> SemanticScope:
+    """The semantic cache scope, the query text and vectors are left to the cache.
+
+    The `fields` change the projection and a user `sparse_vector` changes the
+    sparse retrieval, so they're part of the scope.
+    """
+    return (
+        req.namespace,
+        versions.get(req.namespace),
+        msgspec.msgpack.encode(
+            (req.limit, req.metadata, req.fields, req.sparse_vector),
+            enc_hook=msgspec_encode_np,
+        ),
+    )
+
+
+def call_with_budget(func, arg, budget: float | None, timeout: float):
+    """Call `func(arg)` within the request `budget` if it's shorter than `timeout`.
+
+    Running out of the budget raises `DeadlineExceededError`, which the circuit
+    breaker doesn't blame on the dependency. Otherwise the call keeps the client
+    `timeout`, and a timeout is a failure of the dependency.
+    """
+    if budget is None or budget >= timeout:
+        return func(arg)
+    if budget <= 0:
+        raise DeadlineExceededError("no time left for the call")
+    try:
+        return func(arg, timeout=budget)
+    except TIMEOUT_ERRORS as err:
+        raise DeadlineExceededError(f"timeout after {budget:.3f}s") from err
+
+
+def is_remote(ranker) -> bool:
+    """If the ranker calls a remote service, unknown rankers are assumed remote."""
+    return getattr(ranker, "remote", True)
+
+
+def is_inline(ranker) -> bool:
+    """If the ranker can run in the request thread, unknown rankers are assumed not."""
+    return getattr(ranker, "inline", False)
+
+
+def unranked(req: QueryDocRequest, docs: list[Record]) -> list[DefaultTable]:
+    """The reciprocal rank fusion of the retrieval, used when the rerank is skipped."""
+    fused = RRFRanker(top_k=req.limit).rank(req.to_record(), docs)
+    return [DefaultTable.from_record(record) for record in fused]
+
+
+def combine(querier: Querier, results: dict[str, LegResult]) -> list[Record]:
+    return querier.combine_vector_text(
+        vec_res=results["vector"][0],
+        sparse_res=results["sparse"][0],
+        text_res=results["text"][0],
+    )
+
+
+def render_highlight(
+    req: HighlightRequest, text_scores: list[list[HighlightScore]]
+) -> HighlightResponse:
+    """Merge the word pieces and highlight the words above the threshold."""
+    highlighted = []
+    for text_score in text_scores:
+        words = []
+        highlight_index = set()
+        index = -1
+        for word in text_score:
+            if word.text.startswith("##"):
+                words[-1] += word.text[2:]
                 if word.score >= req.threshold:
                     highlight_index.add(index)
+                continue
 
-            highlighted.append(
-                " ".join(
-                    word if i not in highlight_index else req.template.format(word)
-                    for i, word in enumerate(words)
-                )
+            words.append(word.text)
+            index += 1
+            if req.ignore_stopwords and word.text.lower() in ENGLISH_STOPWORDS:
+                continue
+            if word.score >= req.threshold:
+                highlight_index.add(index)
+
+        highlighted.append(
+            " ".join(
+                word if i not in highlight_index else req.template.format(word)
+                for i, word in enumerate(words)
             )
-        return HighlightResponse(highlighted=highlighted)
+        )
+    return HighlightResponse(highlighted=highlighted)
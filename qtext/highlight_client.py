@@ -28,6 +28,26 @@ class HighlightClient:
         return msgspec.json.decode(resp.content, type=list[list[HighlightScore]])
 
 
+class AsyncHighlightClient:
+    def __init__(self, addr: str) -> None:
+        self.client = httpx.AsyncClient(base_url=addr)
+
+    async def highlight_score(
+        self, query: str, docs: list[str]
+    ) -> list[list[HighlightScore]]:
+        with highlight_histogram.time():
+            resp = await self.client.post("/inference", json=[query, *docs])
+        if resp.is_error:
+            logger.info(
+                "failed to call the highlight service [%d]: %s",
+                resp.status_code,
+                resp.content,
+            )
+            resp.raise_for_status()
+
+        return msgspec.json.decode(resp.content, type=list[list[HighlightScore]])
+
+
 # copied from `nltk.corpus.stopwords.words('english')`
 ENGLISH_STOPWORDS = set(
     [
@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+import queue
+import threading
+from typing import Callable
+from uuid import uuid4
+
+from qtext.cache import LRUCache
+from qtext.config import IngestConfig
+from qtext.log import logger
+from qtext.metrics import ingest_counter, ingest_queue_gauge
+from qtext.spec import IngestStatus
+from qtext.utils import take_batch
+
+
+class IngestQueueFullError(Exception):
+    pass
+
+
+class IngestQueue:
+    """Write the docs in the background with micro-batches.
+
+    The docs are queued with a ticket, the workers take up to `batch_size` docs
+    (waiting at most `linger` seconds for a batch to fill) and write them with
+    `add_docs`, which must write all the docs or none. If a batch fails, its docs
+    are retried one by one so only the bad ones fail. The queue is bounded,
+    `submit` raises `IngestQueueFullError` when it's full. This is best-effort: the
+    queued docs are lost if the process exits.
+
+    The queue is only used by the sync (WSGI) server.
+    """
+
+    def __init__(self, config: IngestConfig, add_docs: Callable[[list], None]):
+        self.add_docs = add_docs
+        self.batch_size = config.batch_size
+        self.linger = config.linger
+        self.queue: queue.Queue[tuple[str, object]] = queue.Queue(
+            maxsize=config.max_depth
+        )
+        self.tickets: LRUCache[str, IngestStatus] = LRUCache(
+            "ingest_ticket", config.max_tickets, config.ticket_ttl
+        )
+        ingest_queue_gauge.set_function(self.queue.qsize)
+        self.workers = [
+            threading.Thread(target=self.work, name=f"qtext-ingest-{i}", daemon=True)
+            for i in range(config.workers)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, req) -> str:
+        ticket = uuid4().hex
+        # set the status first, a worker may finish the doc before `put` returns
+        self.tickets.put(ticket, IngestStatus.QUEUED)
+        try:
+            self.queue.put_nowait((ticket, req))
+        except queue.Full as err:
+            self.tickets.invalidate(ticket)
+            ingest_counter.labels("rejected").inc()
+            raise IngestQueueFullError("ingest queue is full") from err
+        ingest_counter.labels("queued").inc()
+        return ticket
+
+    def status(self, ticket: str) -> IngestStatus | None:
+        return self.tickets.get(ticket)
+
+    def write(self, reqs: list) -> IngestStatus:
+        try:
+            self.add_docs(reqs)
+        except Exception as err:
+            logger.warning("failed to ingest %d docs", len(reqs), exc_info=err)
+            return IngestStatus.FAILED
+        return IngestStatus.DONE
+
+    def work(self):
+        while True:
+            batch = take_batch(self.queue, self.batch_size, self.linger)
+            status = self.write([req for (_, req) in batch])
+            if status == IngestStatus.FAILED and len(batch) > 1:
+                # find the bad docs, the others are still written
+                statuses = [self.write([req]) for (_, req) in batch]
+            else:
+                statuses = [status] * len(batch)
+            for (ticket, _), status in zip(batch, statuses):
+                self.tickets.put(ticket, status)
+                ingest_counter.labels(status.value).inc()
@@ -11,6 +11,20 @@ def run():
     logger.setLevel(config.server.log_level)
     logger.info(config)
     logger.info("starting the server")
+    if config.server.asgi:
+        run_asgi(config)
+        return
     engine = RetrievalEngine(config=config)
     app = create_app(engine)
-    waitress.serve(app, host="0.0.0.0", port=8000)
+    waitress.serve(app, host="0.0.0.0", port=8000, threads=config.server.threads)
+
+
+def run_asgi(config: Config):
+    import uvicorn
+
+    from qtext.async_engine import AsyncRetrievalEngine
+    from qtext.async_server import create_asgi_app
+
+    engine = AsyncRetrievalEngine(config=config)
+    app = create_asgi_app(engine)
+    uvicorn.run(app, host="0.0.0.0", port=8000, log_level=config.server.log_level)
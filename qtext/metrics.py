@@ -1,15 +1,37 @@
-from prometheus_client import Counter, Histogram
+from prometheus_client import Counter, Gauge, Histogram
 
 labels = ("namespace",)
 
 highlight_histogram = Histogram("highlight_latency_seconds", "Highlight cost time")
 rerank_histogram = Histogram("rerank_latency_seconds", "ReRank cost time")
+rerank_stage_histogram = Histogram(
+    "rerank_stage_latency_seconds",
+    "ReRank cost time of each cascade stage",
+    labelnames=("ranker",),
+)
+degrade_counter = Counter(
+    "query_degraded",
+    "Query steps skipped by the deadline or an open circuit breaker",
+    labelnames=("step",),
+)
 doc_counter = Counter("add_doc", "Added documents", labelnames=labels)
 embedding_histogram = Histogram("embedding_latency_seconds", "Embedding cost time")
 sparse_histogram = Histogram("sparse_latency_seconds", "Sparse embedding cost time")
+coalesce_histogram = Histogram(
+    "coalesced_batch_size",
+    "Number of the concurrent calls merged into one batch",
+    labelnames=("client",),
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+)
+cache_counter = Counter(
+    "cache", "In-process cache events", labelnames=("cache", "event")
+)
 add_doc_histogram = Histogram(
     "add_doc_latency_seconds", "Add doc cost time", labelnames=labels
 )
+add_docs_histogram = Histogram(
+    "add_docs_batch_latency_seconds", "Add docs batch cost time", labelnames=labels
+)
 text_search_histogram = Histogram(
     "full_text_search_latency_seconds",
     "Full text search cost time",
@@ -25,3 +47,24 @@ sparse_search_histogram = Histogram(
     "Sparse vector search cost time",
     labelnames=labels,
 )
+hybrid_search_histogram = Histogram(
+    "hybrid_search_latency_seconds",
+    "Hybrid search in one statement cost time",
+    labelnames=labels,
+)
+statement_cache_counter = Counter(
+    "sql_statement_cache",
+    "SQL statement cache lookups",
+    labelnames=(*labels, "result"),
+)
+ingest_queue_gauge = Gauge("ingest_queue_length", "Docs waiting in the ingest queue")
+ingest_counter = Counter(
+    "ingest_docs",
+    "Docs of the ingest queue by event: queued, rejected, done, failed",
+    labelnames=("event",),
+)
+circuit_state_gauge = Gauge(
+    "circuit_breaker_state",
+    "Circuit breaker state: 0 closed, 1 open, 2 half-open",
+    labelnames=("dependency",),
+)
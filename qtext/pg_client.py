@@ -1,7 +1,13 @@
 from __future__ import annotations
 
+import asyncio
+import itertools
 import struct
+import threading
+from collections import defaultdict
+from contextlib import asynccontextmanager, contextmanager
 from time import perf_counter
+from typing import AsyncIterator, Callable, Hashable, Iterator
 
 import numpy as np
 import psycopg
@@ -10,17 +16,27 @@ from psycopg.adapt import Dumper, Loader
 from psycopg.pq import Format
 from psycopg.rows import dict_row
 from psycopg.types import TypeInfo
+from psycopg_pool import AsyncConnectionPool, ConnectionPool, PoolTimeout
 
+from qtext.config import VectorStoreConfig
 from qtext.log import logger
 from qtext.metrics import (
     add_doc_histogram,
+    add_docs_histogram,
     doc_counter,
+    hybrid_search_histogram,
     sparse_search_histogram,
+    statement_cache_counter,
     text_search_histogram,
     vector_search_histogram,
 )
 from qtext.schema import DefaultTable, Querier
-from qtext.spec import AddNamespaceRequest, QueryDocRequest, SparseEmbedding
+from qtext.spec import (
+    AddNamespaceRequest,
+    QueryDocRequest,
+    SparseArray,
+    SparseEmbedding,
+)
 from qtext.utils import time_it
 
 
@@ -28,15 +44,15 @@ class VectorDumper(Dumper):
     format = Format.BINARY
 
     def dump(self, obj):
-        return struct.pack(f"<H{len(obj)}f", len(obj), *obj)
+        vector = np.asarray(obj, dtype="<f4")
+        return struct.pack("<H", len(vector)) + vector.tobytes()
 
 
 class VectorLoader(Loader):
     def load(self, buf):
-        if isinstance(buf, memoryview):
-            buf = bytes(buf)
+        """Decode from the wire buffer without copying, the array is read-only."""
         dim = struct.unpack_from("<H", buf)[0]
-        return np.frombuffer(buf, dtype="<f", count=dim, offset=2)
+        return np.frombuffer(buf, dtype="<f4", count=dim, offset=2)
 
 
 async def register_vector_async(conn: psycopg.AsyncConnection):
@@ -67,7 +83,7 @@ class SparseVectorDumper(Dumper):
     format = Format.BINARY
 
     def dump(self, obj):
-        if isinstance(obj, SparseEmbedding):
+        if isinstance(obj, (SparseArray, SparseEmbedding)):
             return obj.to_bytes()
         raise ValueError(f"unsupported type {type(obj)}")
 
@@ -76,7 +92,12 @@ class SparseVectorLoader(Loader):
     format = Format.BINARY
 
     def load(self, buf):
-        return SparseEmbedding.from_bytes(buf)
+        return SparseArray.from_bytes(buf)
+
+
+async def register_sparse_vector_async(conn: psycopg.AsyncConnection):
+    info = await TypeInfo.fetch(conn=conn, name="svector")
+    register_svector_type(conn, info)
 
 
 def register_sparse_vector(conn: psycopg.Connection):
@@ -94,137 +115,562 @@ def register_svector_type(conn: psycopg.Connection, info: TypeInfo):
 
     adapters = conn.adapters
     adapters.register_dumper(SparseEmbedding, SparseVectorBinaryDumper)
+    adapters.register_dumper(SparseArray, SparseVectorBinaryDumper)
     adapters.register_loader(info.oid, SparseVectorLoader)
 
 
+def query_params(req: QueryDocRequest) -> dict:
+    """The named parameters shared by all the queries."""
+    return {
+        "vector": req.vector,
+        "sparse_vector": req.sparse_vector,
+        "query": " | ".join(req.query.strip().split(" ")),
+        "limit": req.limit,
+        **Querier.filter_params(req.metadata),
+    }
+
+
+def copy_batches(
+    querier: Querier, reqs: list, batch_size: int
+) -> Iterator[tuple[str, list[str], list]]:
+    """Group the docs by the namespace and the inserted columns, in COPY batches."""
+    groups: dict[tuple[str, tuple[str, ...]], list] = defaultdict(list)
+    for req in reqs:
+        attributes = tuple(querier.insert_columns(req))
+        groups[(req.namespace, attributes)].append(req)
+    for (namespace, attributes), docs in groups.items():
+        for i in range(0, len(docs), batch_size):
+            yield namespace, list(attributes), docs[i : i + batch_size]
+
+
+def record_copied(versions: NamespaceVersions, copied: list[tuple[str, int, float]]):
+    """Bump the namespace versions and the metrics after the COPY is committed."""
+    for namespace, count, elapsed in copied:
+        versions.bump(namespace)
+        add_docs_histogram.labels(namespace).observe(elapsed)
+        doc_counter.labels(namespace).inc(count)
+
+
+class StatementCache:
+    """Composed SQL statements of each namespace.
+
+    The statements are keyed by the kind, the selected columns and the shape of
+    the metadata filter, so the values can be sent as parameters of the same
+    (prepared) statement.
+    """
+
+    def __init__(self, querier: Querier, max_size: int = 256) -> None:
+        self.querier = querier
+        # the number of statements kept for each namespace
+        self.max_size = max_size
+        self.statements: dict[str, dict[Hashable, sql.Composable]] = {}
+        self.lock = threading.Lock()
+
+    def get(
+        self, namespace: str, key: Hashable, build: Callable[[], sql.Composable]
+    ) -> sql.Composable:
+        statement = self.statements.get(namespace, {}).get(key)
+        if statement is not None:
+            statement_cache_counter.labels(namespace, "hit").inc()
+            return statement
+        statement_cache_counter.labels(namespace, "miss").inc()
+        statement = build()
+        with self.lock:
+            statements = self.statements.setdefault(namespace, {})
+            if len(statements) >= self.max_size:
+                statements.clear()
+            statements[key] = statement
+        return statement
+
+    def invalidate(self, namespace: str):
+        with self.lock:
+            self.statements.pop(namespace, None)
+
+    def insert(self, namespace: str, columns: list[str]) -> sql.Composable:
+        return self.get(
+            namespace,
+            ("insert", tuple(columns)),
+            lambda: self.querier.insert_query(namespace, columns),
+        )
+
+    def query(self, kind: str, req: QueryDocRequest) -> sql.Composable:
+        """Get the `text`, `vector`, `sparse` or `hybrid` query statement."""
+        columns = self.querier.projection(req.fields)
+        shape = None if req.metadata is None else req.metadata.shape()
+        build = getattr(self.querier, f"{kind}_query")
+        return self.get(
+            req.namespace,
+            (kind, tuple(columns), shape),
+            lambda: build(req.namespace, columns, req.metadata),
+        )
+
+
+class NamespaceVersions:
+    """The write version of each namespace, changed after every committed write.
+
+    The versions come from one counter, so a namespace never gets back an old one.
+    """
+
+    def __init__(self) -> None:
+        self.counter = itertools.count(1)
+        self.versions: dict[str, int] = {}
+
+    def get(self, namespace: str) -> int:
+        return self.versions.get(namespace, 0)
+
+    def bump(self, namespace: str) -> None:
+        self.versions[namespace] = next(self.counter)
+
+
 class PgVectorsClient:
-    def __init__(self, path: str, querier: Querier):
-        self.path = path
+    def __init__(self, config: VectorStoreConfig, querier: Querier):
+        self.path = config.url
+        self.copy_batch_size = config.copy_batch_size
+        self.prefilter = config.prefilter
+        self.prepare = config.prepare
+        self.statements = StatementCache(querier)
+        self.versions = NamespaceVersions()
         self.querier = querier
         self.resp_cls = self.querier.generate_response_class()
-        self.conn = self.connect()
+        self.hybrid_resp_cls = self.querier.generate_hybrid_response_class()
+        self.type_info: dict[str, TypeInfo] = {}
+        self.type_info_lock = threading.Lock()
+        self.conn: psycopg.Connection | None = None
+        self.pool: ConnectionPool | None = None
+        if config.pool_max_size > 0:
+            self.pool = ConnectionPool(
+                self.path,
+                min_size=min(config.pool_min_size, config.pool_max_size),
+                max_size=config.pool_max_size,
+                timeout=config.pool_timeout,
+                kwargs={"row_factory": dict_row},
+                configure=self.configure,
+                check=ConnectionPool.check_connection,
+                open=True,
+            )
+        else:
+            self.conn = self.connect()
 
     def connect(self):
         conn = psycopg.connect(self.path, row_factory=dict_row)
-        conn.execute("CREATE EXTENSION IF NOT EXISTS vectors;")
-        register_vector(conn)
-        register_sparse_vector(conn)
-        conn.commit()
+        self.configure(conn)
         return conn
 
+    def configure(self, conn: psycopg.Connection):
+        """Register the vector types to a new connection.
+
+        The type info is fetched only once and reused by the other connections.
+        """
+        with self.type_info_lock:
+            if not self.type_info:
+                conn.execute("CREATE EXTENSION IF NOT EXISTS vectors;")
+                self.type_info["vector"] = TypeInfo.fetch(conn=conn, name="vector")
+                self.type_info["svector"] = TypeInfo.fetch(conn=conn, name="svector")
+        register_vector_type(conn, self.type_info["vector"])
+        register_svector_type(conn, self.type_info["svector"])
+        if self.prefilter:
+            conn.execute("SET vectors.enable_prefilter = on;")
+        conn.commit()
+
+    @contextmanager
+    def connection(self, timeout: float | None = None) -> Iterator[psycopg.Connection]:
+        """Get a connection from the pool or the shared connection.
+
+        The `timeout` bounds the wait for a pooled connection.
+        """
+        if self.pool is None:
+            yield self.conn
+            return
+        with self.pool.connection(timeout=timeout) as conn:
+            yield conn
+
     def close(self):
-        self.conn.close()
+        if self.pool is not None:
+            self.pool.close()
+        else:
+            self.conn.close()
 
     @time_it
     def add_namespace(self, req: AddNamespaceRequest):
-        try:
-            create_table_sql = self.querier.create_table(
-                req.name, req.vector_dim, req.sparse_vector_dim
-            )
-            vector_index_sql = self.querier.vector_index(req.name)
-            sparse_index_sql = self.querier.sparse_index(req.name)
-            text_index_sql = self.querier.text_index(req.name)
-            self.conn.execute(create_table_sql)
-            self.conn.execute(vector_index_sql)
-            self.conn.execute(sparse_index_sql)
-            self.conn.execute(text_index_sql)
-            self.conn.commit()
-        except psycopg.errors.Error as err:
-            logger.info("pg client create table error", exc_info=err)
-            self.conn.rollback()
-            raise RuntimeError("add namespace error") from err
+        with self.connection() as conn:
+            try:
+                create_table_sql = self.querier.create_table(
+                    req.name, req.vector_dim, req.sparse_vector_dim
+                )
+                vector_index_sql = self.querier.vector_index(req.name)
+                sparse_index_sql = self.querier.sparse_index(req.name)
+                text_index_sql = self.querier.text_index(req.name)
+                conn.execute(create_table_sql)
+                conn.execute(vector_index_sql)
+                conn.execute(sparse_index_sql)
+                conn.execute(text_index_sql)
+                conn.commit()
+                self.statements.invalidate(req.name)
+                self.versions.bump(req.name)
+            except psycopg.errors.Error as err:
+                logger.info("pg client create table error", exc_info=err)
+                conn.rollback()
+                raise RuntimeError("add namespace error") from err
 
     def add_doc(self, req):
+        with self.connection() as conn:
+            try:
+                attributes = self.querier.insert_columns(req)
+                placeholders = [getattr(req, key) for key in attributes]
+                start_time = perf_counter()
+                conn.execute(
+                    self.statements.insert(req.namespace, attributes),
+                    placeholders,
+                    prepare=self.prepare,
+                )
+                conn.commit()
+                self.versions.bump(req.namespace)
+                add_doc_histogram.labels(req.namespace).observe(
+                    perf_counter() - start_time
+                )
+                doc_counter.labels(req.namespace).inc()
+            except psycopg.errors.Error as err:
+                logger.info("pg client add doc error", exc_info=err)
+                conn.rollback()
+                raise RuntimeError("add doc error") from err
+
+    @time_it
+    def add_docs(self, reqs: list):
+        """Insert the docs with binary COPY in one transaction.
+
+        Docs are grouped by the namespace and the inserted columns, each group is
+        copied in batches. Nothing is written if any batch fails, so the whole call
+        can be retried.
+        """
+        with self.connection() as conn:
+            try:
+                copied = [
+                    self.copy_docs(conn, namespace, attributes, docs)
+                    for namespace, attributes, docs in copy_batches(
+                        self.querier, reqs, self.copy_batch_size
+                    )
+                ]
+                conn.commit()
+            except psycopg.errors.Error as err:
+                logger.info("pg client copy docs error", exc_info=err)
+                conn.rollback()
+                raise RuntimeError("add docs error") from err
+            except Exception:
+                conn.rollback()
+                raise
+        record_copied(self.versions, copied)
+
+    def copy_docs(
+        self, conn: psycopg.Connection, namespace: str, attributes: list[str], docs
+    ) -> tuple[str, int, float]:
+        start_time = perf_counter()
+        with conn.cursor() as cursor, cursor.copy(
+            self.querier.copy_query(namespace, attributes)
+        ) as copy:
+            copy.set_types(self.querier.column_types(attributes))
+            for doc in docs:
+                copy.write_row([getattr(doc, key) for key in attributes])
+        return namespace, len(docs), perf_counter() - start_time
+
+    def fetch(  # noqa: PLR0913
+        self, query, params, histogram, error: str, timeout: float | None = None
+    ) -> list[dict]:
+        """Run the query, the `timeout` (seconds) also bounds the statement.
+
+        A query that runs out of the `timeout` raises `TimeoutError`. This needs the
+        connection pool: the concurrent legs share the transaction of the shared
+        connection (and run one at a time on its lock), a `statement_timeout` or a
+        cancelled statement there would leak into the other legs, so the `timeout`
+        is ignored.
+        """
         try:
-            attributes = self.querier.columns()
-            primary_id = self.querier.primary_key
-            if primary_id is None or getattr(req, primary_id, None) is None:
-                attributes.remove(primary_id)
-            placeholders = [getattr(req, key) for key in attributes]
-            start_time = perf_counter()
-            self.conn.execute(
-                sql.SQL(
-                    "INSERT INTO {table} ({fields}) VALUES ({placeholders})"
-                ).format(
-                    table=sql.Identifier(req.namespace),
-                    fields=sql.SQL(",").join(map(sql.Identifier, attributes)),
-                    placeholders=sql.SQL(",").join(
-                        sql.Placeholder() for _ in range(len(placeholders))
-                    ),
-                ),
-                placeholders,
-            )
-            self.conn.commit()
-            add_doc_histogram.labels(req.namespace).observe(perf_counter() - start_time)
-            doc_counter.labels(req.namespace).inc()
-        except psycopg.errors.Error as err:
-            logger.info("pg client add doc error", exc_info=err)
-            self.conn.rollback()
-            raise RuntimeError("add doc error") from err
+            with self.connection(timeout) as conn:
+                try:
+                    start_time = perf_counter()
+                    if timeout is not None and self.pool is not None:
+                        # local to the transaction, ends with the pooled connection
+                        conn.execute(
+                            "SELECT set_config('statement_timeout', %s, true)",
+                            [f"{max(int(timeout * 1000), 1)}ms"],
+                        )
+                    cursor = conn.execute(
+                        query, params, binary=True, prepare=self.prepare
+                    )
+                    results = cursor.fetchall()
+                    histogram.observe(perf_counter() - start_time)
+                except psycopg.errors.QueryCanceled as err:
+                    conn.rollback()
+                    raise TimeoutError(f"{error}: timeout") from err
+                except psycopg.errors.Error as err:
+                    logger.info("pg client %s", error, exc_info=err)
+                    conn.rollback()
+                    raise RuntimeError(error) from err
+        except PoolTimeout as err:
+            raise TimeoutError(f"{error}: no connection available") from err
+        return results
 
     @time_it
-    def query_text(self, req: QueryDocRequest) -> list[DefaultTable]:
+    def query_text(
+        self, req: QueryDocRequest, timeout: float | None = None
+    ) -> list[DefaultTable]:
         if not self.querier.has_text_index():
             logger.debug("skip text query since there is no text index")
             return []
-        try:
-            start_time = perf_counter()
-            cursor = self.conn.execute(
-                self.querier.text_query(req.namespace),
-                (" | ".join(req.query.strip().split(" ")), req.limit),
-                binary=True,
-            )
-            results = cursor.fetchall()
-            text_search_histogram.labels(req.namespace).observe(
-                perf_counter() - start_time
-            )
-        except psycopg.errors.Error as err:
-            logger.info("pg client query text error", exc_info=err)
-            self.conn.rollback()
-            raise RuntimeError("query text error") from err
+        results = self.fetch(
+            self.statements.query("text", req),
+            query_params(req),
+            text_search_histogram.labels(req.namespace),
+            "query text error",
+            timeout,
+        )
         return [self.resp_cls(**res) for res in results]
 
     @time_it
-    def query_vector(self, req: QueryDocRequest) -> list[DefaultTable]:
+    def query_vector(
+        self, req: QueryDocRequest, timeout: float | None = None
+    ) -> list[DefaultTable]:
         if not self.querier.has_vector_index():
             logger.debug("skip vector query since there is no vector index")
             return []
-        try:
-            # TODO: filter
-            start_time = perf_counter()
-            cursor = self.conn.execute(
-                self.querier.vector_query(req.namespace),
-                (req.vector, req.limit),
-                binary=True,
-            )
-            results = cursor.fetchall()
-            vector_search_histogram.labels(req.namespace).observe(
-                perf_counter() - start_time
-            )
-        except psycopg.errors.Error as err:
-            logger.info("pg client query vector error", exc_info=err)
-            self.conn.rollback()
-            raise RuntimeError("query vector error") from err
+        results = self.fetch(
+            self.statements.query("vector", req),
+            query_params(req),
+            vector_search_histogram.labels(req.namespace),
+            "query vector error",
+            timeout,
+        )
         return [self.resp_cls(**res) for res in results]
 
     @time_it
-    def query_sparse_vector(self, req: QueryDocRequest) -> list[DefaultTable]:
+    def query_sparse_vector(
+        self, req: QueryDocRequest, timeout: float | None = None
+    ) -> list[DefaultTable]:
         if not self.querier.has_sparse_index():
             logger.debug("skip sparse vector query since there is no sparse index")
             return []
-        try:
-            start_time = perf_counter()
-            cursor = self.conn.execute(
-                self.querier.sparse_query(req.namespace),
-                (req.sparse_vector, req.limit),
-                binary=True,
-            )
-            results = cursor.fetchall()
-            sparse_search_histogram.labels(req.namespace).observe(
-                perf_counter() - start_time
-            )
-        except psycopg.errors.Error as err:
-            logger.info("pg client query sparse vector error", exc_info=err)
-            self.conn.rollback()
-            raise RuntimeError("query sparse vector error") from err
+        results = self.fetch(
+            self.statements.query("sparse", req),
+            query_params(req),
+            sparse_search_histogram.labels(req.namespace),
+            "query sparse vector error",
+            timeout,
+        )
         return [self.resp_cls(**res) for res in results]
+
+    @time_it
+    def query_hybrid(
+        self, req: QueryDocRequest, timeout: float | None = None
+    ) -> list[DefaultTable]:
+        results = self.fetch(
+            self.statements.query("hybrid", req),
+            query_params(req),
+            hybrid_search_histogram.labels(req.namespace),
+            "hybrid query error",
+            timeout,
+        )
+        return [self.hybrid_resp_cls(**res) for res in results]
+
+
+# the default pool size of the async client
+ASYNC_POOL_SIZE = 16
+
+
+class AsyncPgVectorsClient:
+    def __init__(self, config: VectorStoreConfig, querier: Querier):
+        """
+        Async version of the `PgVectorsClient`, connections are always pooled. If the
+        `pool_max_size` is 0, the pool has up to `ASYNC_POOL_SIZE` connections, one
+        connection would serialize all the queries of the server.
+
+        The pool should be opened in the event loop with `open()`.
+        """
+        self.path = config.url
+        self.copy_batch_size = config.copy_batch_size
+        self.prefilter = config.prefilter
+        self.prepare = config.prepare
+        self.statements = StatementCache(querier)
+        self.versions = NamespaceVersions()
+        self.querier = querier
+        self.resp_cls = self.querier.generate_response_class()
+        self.hybrid_resp_cls = self.querier.generate_hybrid_response_class()
+        self.type_info: dict[str, TypeInfo] = {}
+        self.type_info_lock = asyncio.Lock()
+        max_size = config.pool_max_size or ASYNC_POOL_SIZE
+        self.pool = AsyncConnectionPool(
+            self.path,
+            min_size=min(config.pool_min_size, max_size),
+            max_size=max_size,
+            timeout=config.pool_timeout,
+            kwargs={"row_factory": dict_row},
+            configure=self.configure,
+            check=AsyncConnectionPool.check_connection,
+            open=False,
+        )
+
+    async def open(self):
+        await self.pool.open(wait=True)
+
+    async def close(self):
+        await self.pool.close()
+
+    async def configure(self, conn: psycopg.AsyncConnection):
+        async with self.type_info_lock:
+            if not self.type_info:
+                await conn.execute("CREATE EXTENSION IF NOT EXISTS vectors;")
+                self.type_info["vector"] = await TypeInfo.fetch(
+                    conn=conn, name="vector"
+                )
+                self.type_info["svector"] = await TypeInfo.fetch(
+                    conn=conn, name="svector"
+                )
+        register_vector_type(conn, self.type_info["vector"])
+        register_svector_type(conn, self.type_info["svector"])
+        if self.prefilter:
+            await conn.execute("SET vectors.enable_prefilter = on;")
+        await conn.commit()
+
+    @asynccontextmanager
+    async def connection(self) -> AsyncIterator[psycopg.AsyncConnection]:
+        async with self.pool.connection() as conn:
+            yield conn
+
+    @time_it
+    async def add_namespace(self, req: AddNamespaceRequest):
+        async with self.connection() as conn:
+            try:
+                create_table_sql = self.querier.create_table(
+                    req.name, req.vector_dim, req.sparse_vector_dim
+                )
+                await conn.execute(create_table_sql)
+                await conn.execute(self.querier.vector_index(req.name))
+                await conn.execute(self.querier.sparse_index(req.name))
+                await conn.execute(self.querier.text_index(req.name))
+                await conn.commit()
+                self.statements.invalidate(req.name)
+                self.versions.bump(req.name)
+            except psycopg.errors.Error as err:
+                logger.info("pg client create table error", exc_info=err)
+                await conn.rollback()
+                raise RuntimeError("add namespace error") from err
+
+    async def add_doc(self, req):
+        async with self.connection() as conn:
+            try:
+                attributes = self.querier.insert_columns(req)
+                placeholders = [getattr(req, key) for key in attributes]
+                start_time = perf_counter()
+                await conn.execute(
+                    self.statements.insert(req.namespace, attributes),
+                    placeholders,
+                    prepare=self.prepare,
+                )
+                await conn.commit()
+                self.versions.bump(req.namespace)
+                add_doc_histogram.labels(req.namespace).observe(
+                    perf_counter() - start_time
+                )
+                doc_counter.labels(req.namespace).inc()
+            except psycopg.errors.Error as err:
+                logger.info("pg client add doc error", exc_info=err)
+                await conn.rollback()
+                raise RuntimeError("add doc error") from err
+
+    @time_it
+    async def add_docs(self, reqs: list):
+        async with self.connection() as conn:
+            try:
+                copied = [
+                    await self.copy_docs(conn, namespace, attributes, docs)
+                    for namespace, attributes, docs in copy_batches(
+                        self.querier, reqs, self.copy_batch_size
+                    )
+                ]
+                await conn.commit()
+            except psycopg.errors.Error as err:
+                logger.info("pg client copy docs error", exc_info=err)
+                await conn.rollback()
+                raise RuntimeError("add docs error") from err
+            except Exception:
+                await conn.rollback()
+                raise
+        record_copied(self.versions, copied)
+
+    async def copy_docs(
+        self,
+        conn: psycopg.AsyncConnection,
+        namespace: str,
+        attributes: list[str],
+        docs: list,
+    ) -> tuple[str, int, float]:
+        start_time = perf_counter()
+        async with conn.cursor() as cursor, cursor.copy(
+            self.querier.copy_query(namespace, attributes)
+        ) as copy:
+            copy.set_types(self.querier.column_types(attributes))
+            for doc in docs:
+                await copy.write_row([getattr(doc, key) for key in attributes])
+        return namespace, len(docs), perf_counter() - start_time
+
+    async def fetch(self, query, params, histogram, error: str) -> list[dict]:
+        async with self.connection() as conn:
+            try:
+                start_time = perf_counter()
+                cursor = await conn.execute(
+                    query, params, binary=True, prepare=self.prepare
+                )
+                results = await cursor.fetchall()
+                histogram.observe(perf_counter() - start_time)
+            except psycopg.errors.Error as err:
+                logger.info("pg client %s", error, exc_info=err)
+                await conn.rollback()
+                raise RuntimeError(error) from err
+        return results
+
+    @time_it
+    async def query_text(self, req: QueryDocRequest) -> list[DefaultTable]:
+        if not self.querier.has_text_index():
+            logger.debug("skip text query since there is no text index")
+            return []
+        results = await self.fetch(
+            self.statements.query("text", req),
+            query_params(req),
+            text_search_histogram.labels(req.namespace),
+            "query text error",
+        )
+        return [self.resp_cls(**res) for res in results]
+
+    @time_it
+    async def query_vector(self, req: QueryDocRequest) -> list[DefaultTable]:
+        if not self.querier.has_vector_index():
+            logger.debug("skip vector query since there is no vector index")
+            return []
+        results = await self.fetch(
+            self.statements.query("vector", req),
+            query_params(req),
+            vector_search_histogram.labels(req.namespace),
+            "query vector error",
+        )
+        return [self.resp_cls(**res) for res in results]
+
+    @time_it
+    async def query_sparse_vector(self, req: QueryDocRequest) -> list[DefaultTable]:
+        if not self.querier.has_sparse_index():
+            logger.debug("skip sparse vector query since there is no sparse index")
+            return []
+        results = await self.fetch(
+            self.statements.query("sparse", req),
+            query_params(req),
+            sparse_search_histogram.labels(req.namespace),
+            "query sparse vector error",
+        )
+        return [self.resp_cls(**res) for res in results]
+
+    @time_it
+    async def query_hybrid(self, req: QueryDocRequest) -> list[DefaultTable]:
+        results = await self.fetch(
+            self.statements.query("hybrid", req),
+            query_params(req),
+            hybrid_search_histogram.labels(req.namespace),
+            "hybrid query error",
+        )
+        return [self.hybrid_resp_cls(**res) for res in results]
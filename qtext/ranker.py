@@ -1,8 +1,14 @@
 from __future__ import annotations
 
 import abc
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from enum import Enum
+from functools import partial
+from itertools import chain
+from operator import attrgetter
+from pathlib import Path
 from typing import overload
 
 import cohere
@@ -10,7 +16,11 @@ import httpx
 import msgspec
 import numpy as np
 
+from qtext.cache import ScoreCache
+from qtext.log import logger
+from qtext.metrics import rerank_stage_histogram
 from qtext.spec import Record
+from qtext.utils import batched
 
 
 def euclidean(x: np.ndarray, y: np.ndarray) -> float:
@@ -32,64 +42,332 @@ class Distance(Enum):
 
 
 class Ranker(abc.ABC):
+    # the record fields used by this ranker, `None` means all the fields
+    required_fields: frozenset[str] | None = None
+    # if this ranker calls a remote service, only those use the circuit breaker
+    remote: bool = False
+    # if this ranker is cheap enough to run in the request thread, the others run
+    # in the rank pool within the deadline
+    inline: bool = True
+
     @abc.abstractmethod
     def rank(self, query: Record, docs: list[Record]) -> list[Record]:
         pass
 
+    async def arank(self, query: Record, docs: list[Record]) -> list[Record]:
+        """Rank in the async engine, the local rankers don't need to override this."""
+        return self.rank(query, docs)
+
+    def rank_with_scores(
+        self, query: Record, docs: list[Record]
+    ) -> tuple[list[Record], np.ndarray | None]:
+        """Rank and return the scores of the ranked docs, `None` if not scored."""
+        return self.rank(query, docs), None
+
+    async def arank_with_scores(
+        self, query: Record, docs: list[Record]
+    ) -> tuple[list[Record], np.ndarray | None]:
+        return await self.arank(query, docs), None
+
 
 class CrossEncoderClient(Ranker):
-    def __init__(self, model_name: str, addr: str, top_k: int = 0):
+    required_fields = frozenset(("text",))
+    remote = True
+    inline = False
+
+    def __init__(  # noqa: PLR0913
+        self,
+        model_name: str,
+        addr: str,
+        top_k: int = 0,
+        chunk_size: int = 0,
+        max_connections: int = 8,
+        cache_size: int = 65536,
+        cache_ttl: float = 3600,
+    ):
+        """
+        Rank documents with the cross-encoder service.
+
+        Args:
+            model_name: The cross-encoder model name.
+            addr: The address of the cross-encoder service.
+            top_k: The number of documents to return, 0 means all.
+            chunk_size: Split the documents into requests of this size, which are
+                sent concurrently to use all the service workers. 0 sends one
+                request.
+            max_connections: The number of keep-alive connections (and concurrent
+                requests) to the service.
+            cache_size: The number of cached (query, doc) scores, 0 disables it.
+            cache_ttl: Seconds before a cached score expires, 0 means never.
+        """
         self.model_name = model_name
-        self.client = httpx.Client(base_url=addr)
-        self.top_k = top_k
+        self.top_k = int(top_k)
+        self.chunk_size = int(chunk_size)
+        max_connections = int(max_connections)
+        limits = httpx.Limits(
+            max_connections=max_connections, max_keepalive_connections=max_connections
+        )
+        self.client = httpx.Client(base_url=addr, limits=limits)
+        self.async_client = httpx.AsyncClient(base_url=addr, limits=limits)
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_connections, thread_name_prefix="qtext-cross-encoder"
+        )
+        self.score_cache = ScoreCache(
+            "cross_encoder_score", model_name, int(cache_size), float(cache_ttl)
+        )
 
-    def score(self, query: Record, docs: list[Record]) -> list[float]:
+    def chunks(self, texts: list[str]) -> list[list[str]]:
+        return list(batched(texts, self.chunk_size or len(texts) or 1))
+
+    @staticmethod
+    def decode_scores(resp: httpx.Response) -> list[float]:
+        resp.raise_for_status()
+        return msgspec.msgpack.decode(resp.content)["scores"]
+
+    def inference(self, query: str, texts: list[str]) -> list[float]:
         resp = self.client.post(
             "/inference",
-            content=msgspec.msgpack.encode(
-                {
-                    "query": query.text,
-                    "docs": [doc.text for doc in docs],
-                }
-            ),
+            content=msgspec.msgpack.encode({"query": query, "docs": texts}),
+        )
+        return self.decode_scores(resp)
+
+    async def ainference(self, query: str, texts: list[str]) -> list[float]:
+        resp = await self.async_client.post(
+            "/inference",
+            content=msgspec.msgpack.encode({"query": query, "docs": texts}),
+        )
+        return self.decode_scores(resp)
+
+    def score_texts(self, query: str, texts: list[str]) -> list[float]:
+        chunks = self.chunks(texts)
+        if len(chunks) <= 1:
+            return self.inference(query, chunks[0]) if chunks else []
+        return list(
+            chain.from_iterable(
+                self.executor.map(partial(self.inference, query), chunks)
+            )
+        )
+
+    async def ascore_texts(self, query: str, texts: list[str]) -> list[float]:
+        chunks = await asyncio.gather(
+            *(self.ainference(query, chunk) for chunk in self.chunks(texts))
+        )
+        return list(chain.from_iterable(chunks))
+
+    def score(self, query: Record, docs: list[Record]) -> list[float]:
+        return self.score_cache.score(
+            query.text, [doc.text for doc in docs], self.score_texts
+        )
+
+    async def ascore(self, query: Record, docs: list[Record]) -> list[float]:
+        return await self.score_cache.ascore(
+            query.text, [doc.text for doc in docs], self.ascore_texts
         )
-        resp.raise_for_status()
-        return msgspec.msgpack.decode(resp.content)["scores"]
 
     def rank(self, query: Record, docs: list[Record]) -> list[Record]:
-        top_k = len(docs) if self.top_k == 0 else self.top_k
-        scores = self.score(query, docs)
-        return [
-            doc
-            for (_, doc) in sorted(zip(scores, docs), key=lambda x: x[0], reverse=True)
-        ][:top_k]
+        return self.rank_with_scores(query, docs)[0]
+
+    async def arank(self, query: Record, docs: list[Record]) -> list[Record]:
+        return (await self.arank_with_scores(query, docs))[0]
+
+    def rank_with_scores(
+        self, query: Record, docs: list[Record]
+    ) -> tuple[list[Record], np.ndarray]:
+        return sort_by_scores(docs, self.score(query, docs), self.top_k)
+
+    async def arank_with_scores(
+        self, query: Record, docs: list[Record]
+    ) -> tuple[list[Record], np.ndarray]:
+        return sort_by_scores(docs, await self.ascore(query, docs), self.top_k)
 
 
 class CohereClient(Ranker):
-    def __init__(self, model_name: str, key: str, top_k: int = 0):
+    required_fields = frozenset(("text",))
+    remote = True
+    inline = False
+
+    def __init__(  # noqa: PLR0913
+        self,
+        model_name: str,
+        key: str,
+        top_k: int = 0,
+        cache_size: int = 65536,
+        cache_ttl: float = 3600,
+    ):
         self.model_name = model_name
         self.client = cohere.Client(api_key=key)
-        self.top_k = top_k
+        self.async_client = cohere.AsyncClient(api_key=key)
+        self.top_k = int(top_k)
+        self.score_cache = ScoreCache(
+            "cohere_score", model_name, int(cache_size), float(cache_ttl)
+        )
 
-    def score(self, query: Record, docs: list[Record]) -> list[float]:
+    @staticmethod
+    def relevance_scores(ranks, length: int) -> list[float]:
+        # the results are sorted by the relevance, map them back to the input order
+        scores = [0.0] * length
+        for rank in ranks.results:
+            scores[rank.index] = rank.relevance_score
+        return scores
+
+    def score_texts(self, query: str, texts: list[str]) -> list[float]:
         ranks = self.client.rerank(
-            query=query.text,
-            documents=[doc.text for doc in docs],
+            query=query,
+            documents=texts,
             model=self.model_name,
         )
-        scores = [rank.relevance_score for rank in ranks.results]
-        return scores
+        return self.relevance_scores(ranks, len(texts))
+
+    async def ascore_texts(self, query: str, texts: list[str]) -> list[float]:
+        ranks = await self.async_client.rerank(
+            query=query,
+            documents=texts,
+            model=self.model_name,
+        )
+        return self.relevance_scores(ranks, len(texts))
+
+    def score(self, query: Record, docs: list[Record]) -> list[float]:
+        return self.score_cache.score(
+            query.text, [doc.text for doc in docs], self.score_texts
+        )
+
+    async def ascore(self, query: Record, docs: list[Record]) -> list[float]:
+        return await self.score_cache.ascore(
+            query.text, [doc.text for doc in docs], self.ascore_texts
+        )
+
+    def rank(self, query: Record, docs: list[Record]) -> list[Record]:
+        return self.rank_with_scores(query, docs)[0]
+
+    async def arank(self, query: Record, docs: list[Record]) -> list[Record]:
+        return (await self.arank_with_scores(query, docs))[0]
+
+    def rank_with_scores(
+        self, query: Record, docs: list[Record]
+    ) -> tuple[list[Record], np.ndarray]:
+        return sort_by_scores(docs, self.score(query, docs), self.top_k)
+
+    async def arank_with_scores(
+        self, query: Record, docs: list[Record]
+    ) -> tuple[list[Record], np.ndarray]:
+        return sort_by_scores(docs, await self.ascore(query, docs), self.top_k)
+
+
+class OnnxCrossEncoder(Ranker):
+    required_fields = frozenset(("text",))
+    # the model inference is the most expensive step of a query
+    inline = False
+
+    def __init__(  # noqa: PLR0913
+        self,
+        model_path: str,
+        tokenizer_path: str = "",
+        top_k: int = 0,
+        batch_size: int = 32,
+        max_length: int = 512,
+        intra_op_threads: int = 0,
+        cache_size: int = 65536,
+        cache_ttl: float = 3600,
+    ):
+        """
+        Rank documents with an ONNX cross-encoder model in this process.
+
+        This requires `pip install qtext[onnx]`. The model can be exported (and
+        quantized) with `optimum-cli export onnx`, the scores are the sigmoid of the
+        first logit, the same as the `sentence-transformers` cross-encoder.
+
+        Args:
+            model_path: The ONNX model file.
+            tokenizer_path: The `tokenizer.json` file, default to the one in the
+                model directory.
+            top_k: The number of documents to return, 0 means all.
+            batch_size: The number of (query, doc) pairs in one inference, the docs
+                are sorted by length so each batch has less padding.
+            max_length: The max number of tokens of a (query, doc) pair.
+            intra_op_threads: The number of threads of one inference, 0 means the
+                number of physical cores.
+            cache_size: The number of cached (query, doc) scores, 0 disables it.
+            cache_ttl: Seconds before a cached score expires, 0 means never.
+        """
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        self.top_k = int(top_k)
+        self.batch_size = int(batch_size)
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = int(intra_op_threads)
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(
+            model_path, options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {node.name for node in self.session.get_inputs()}
+
+        self.tokenizer = Tokenizer.from_file(
+            tokenizer_path or str(Path(model_path).with_name("tokenizer.json"))
+        )
+        self.tokenizer.enable_truncation(int(max_length))
+        padding = self.tokenizer.padding or {}
+        self.tokenizer.enable_padding(
+            pad_id=padding.get("pad_id", 0), pad_token=padding.get("pad_token", "[PAD]")
+        )
+        self.score_cache = ScoreCache(
+            "onnx_score", model_path, int(cache_size), float(cache_ttl)
+        )
+
+    def inference(self, query: str, texts: list[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch([(query, text) for text in texts])
+        inputs = {
+            "input_ids": [encoding.ids for encoding in encodings],
+            "attention_mask": [encoding.attention_mask for encoding in encodings],
+            "token_type_ids": [encoding.type_ids for encoding in encodings],
+        }
+        logits = self.session.run(
+            None,
+            {
+                name: np.array(value, dtype=np.int64)
+                for name, value in inputs.items()
+                if name in self.input_names
+            },
+        )[0]
+        return 1 / (1 + np.exp(-logits.reshape(len(texts), -1)[:, 0]))
+
+    def score_texts(self, query: str, texts: list[str]) -> list[float]:
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        scores = np.zeros(len(texts))
+        for batch in batched(order, self.batch_size):
+            scores[batch] = self.inference(query, [texts[i] for i in batch])
+        return scores.tolist()
+
+    def score(self, query: Record, docs: list[Record]) -> list[float]:
+        return self.score_cache.score(
+            query.text, [doc.text for doc in docs], self.score_texts
+        )
+
+    async def ascore(self, query: Record, docs: list[Record]) -> list[float]:
+        # the inference releases the GIL, don't block the event loop
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.score, query, docs)
 
     def rank(self, query: Record, docs: list[Record]) -> list[Record]:
-        top_k = len(docs) if self.top_k == 0 else self.top_k
-        scores = self.score(query, docs)
-        return [
-            doc
-            for (_, doc) in sorted(zip(scores, docs), key=lambda x: x[0], reverse=True)
-        ][:top_k]
+        return self.rank_with_scores(query, docs)[0]
+
+    async def arank(self, query: Record, docs: list[Record]) -> list[Record]:
+        return (await self.arank_with_scores(query, docs))[0]
+
+    def rank_with_scores(
+        self, query: Record, docs: list[Record]
+    ) -> tuple[list[Record], np.ndarray]:
+        return sort_by_scores(docs, self.score(query, docs), self.top_k)
+
+    async def arank_with_scores(
+        self, query: Record, docs: list[Record]
+    ) -> tuple[list[Record], np.ndarray]:
+        return sort_by_scores(docs, await self.ascore(query, docs), self.top_k)
 
 
 class DiverseRanker(Ranker):
+    required_fields = frozenset(("vector",))
+
     def __init__(
         self,
         lambda_const: float = 0.3,
@@ -111,160 +389,333 @@ class DiverseRanker(Ranker):
         self.distance = distance
         self.threshold = threshold
 
+    def similarity(
+        self, query: np.ndarray, vectors: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """The query-doc and doc-doc "similarity" (the distance) of all the docs."""
+        # `einsum` keeps the duplicate docs' scores bit-identical, the ties must be
+        # broken by the doc order as the pairwise version does
+        query_dot = np.einsum("ij,j->i", vectors, query)
+        gram = np.einsum("ik,jk->ij", vectors, vectors)
+        if self.distance is dot_product:
+            return query_dot, gram
+        if self.distance is cosine:
+            norms = np.linalg.norm(vectors, axis=1)
+            query_sim = 1 - query_dot / (norms * np.linalg.norm(query))
+            return query_sim, 1 - gram / np.outer(norms, norms)
+        if self.distance is euclidean:
+            squared = np.diagonal(gram)
+            pairwise = squared[:, None] + squared[None, :] - 2 * gram
+            query_sim = np.linalg.norm(vectors - query, axis=1)
+            return query_sim, np.sqrt(np.maximum(pairwise, 0))
+        # custom distance function
+        length = len(vectors)
+        pairwise = np.zeros((length, length))
+        for i in range(length):
+            for j in range(i + 1, length):
+                pairwise[i, j] = pairwise[j, i] = self.distance(vectors[i], vectors[j])
+        query_sim = np.array([self.distance(query, vector) for vector in vectors])
+        return query_sim, pairwise
+
     def rank(self, query: Record, docs: list[Record]) -> list[Record]:
         if not docs or docs[0].vector is None:
             raise ValueError("`vector` is required for diverse ranking")
 
-        # convert to np array for distance computation
-        query.use_np()
-        for doc in docs:
-            doc.use_np()
-        # pre-compute similarity scores
-        similarity: dict[str, float] = {}
-        length = len(docs)
-        for i in range(length):
-            for j in range(i + 1, length):
-                similarity[f"{i}_{j}"] = similarity[f"{j}_{i}"] = self.distance(
-                    docs[i].vector, docs[j].vector
-                )
-            similarity[f"query_{i}"] = self.distance(query.vector, docs[i].vector)
-
-        candidates, selected = list(range(len(docs))), []
-        while candidates:
-            scores = []
-            for c in candidates:
-                sim_q = similarity[f"query_{c}"]
-                sim_d = max(similarity[f"{c}_{s}"] for s in selected) if selected else 0
-                scores.append(
-                    self.lambda_const * sim_q - (1 - self.lambda_const) * sim_d
-                )
-            mmr = max(scores)
-            if mmr < self.threshold:
+        query_sim, doc_sim = self.similarity(
+            np.asarray(query.vector, dtype=np.float64),
+            np.stack([np.asarray(doc.vector, dtype=np.float64) for doc in docs]),
+        )
+        # the max similarity to the selected docs, 0 before any doc is selected
+        max_sim = np.zeros(len(docs))
+        remaining = np.ones(len(docs), dtype=bool)
+        selected: list[int] = []
+        while len(selected) < len(docs):
+            scores = self.lambda_const * query_sim - (1 - self.lambda_const) * max_sim
+            scores[~remaining] = -np.inf
+            # `argmax` returns the first max, the same as the candidates order
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
                 break
-            max_idx = scores.index(max(scores))
-            selected.append(candidates.pop(max_idx))
+            selected.append(best)
+            remaining[best] = False
+            max_sim = (
+                doc_sim[best]
+                if len(selected) == 1
+                else np.maximum(max_sim, doc_sim[best])
+            )
         return [docs[i] for i in selected]
 
 
-class TimeDecayRanker(Ranker):
-    def __init__(self, decay_rate: float = 1.8) -> None:
+def top_k_indices(scores: np.ndarray, top_k: int = 0) -> np.ndarray:
+    """The indices of the `top_k` (0 means all) highest scores in descending order.
+
+    This is the same as a stable sort of all the scores: the ties keep the input
+    order, but only the top `k` are sorted after an `O(n)` partition. The NaN
+    scores are ranked last, they would break the partition.
+    """
+    scores = np.nan_to_num(scores, nan=-np.inf, posinf=np.inf, neginf=-np.inf)
+    if 0 < top_k < len(scores):
+        kth = np.partition(scores, len(scores) - top_k)[len(scores) - top_k]
+        higher = np.flatnonzero(scores > kth)
+        ties = np.flatnonzero(scores == kth)[: top_k - len(higher)]
+        candidates = np.sort(np.concatenate((higher, ties)))
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+def sort_by_scores(
+    docs: list[Record], scores, top_k: int = 0
+) -> tuple[list[Record], np.ndarray]:
+    scores = np.asarray(scores, dtype=np.float64)
+    order = top_k_indices(scores, top_k)
+    return [docs[i] for i in order], scores[order]
+
+
+class Columns:
+    """The record fields as NumPy columns, each field is extracted once."""
+
+    def __init__(self, docs: list[Record]) -> None:
+        self.docs = docs
+        self.columns: dict[str, np.ndarray] = {}
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        if name not in self.columns:
+            self.columns[name] = np.fromiter(
+                map(attrgetter(name), self.docs),
+                dtype=np.float64,
+                count=len(self.docs),
+            )
+        return self.columns[name]
+
+    def hours_since(self, name: str, current: datetime) -> np.ndarray:
+        # NumPy `datetime64` conversion is slower than the `timedelta` in Python
+        return (
+            np.fromiter(
+                ((current - getattr(doc, name)).total_seconds() for doc in self.docs),
+                dtype=np.float64,
+                count=len(self.docs),
+            )
+            / 3600.0
+        )
+
+
+class ScoreRanker(Ranker):
+    """Rank by the scores computed from the record columns, higher is better."""
+
+    top_k: int = 0
+
+    @abc.abstractmethod
+    def score_columns(self, columns: Columns) -> np.ndarray:
+        pass
+
+    def score(self, query: Record, docs: list[Record]) -> np.ndarray:
+        """Higher score is better."""
+        return self.score_columns(Columns(docs))
+
+    def rank(self, query: Record, docs: list[Record]) -> list[Record]:
+        return self.rank_with_scores(query, docs)[0]
+
+    def rank_with_scores(
+        self, query: Record, docs: list[Record]
+    ) -> tuple[list[Record], np.ndarray]:
+        return sort_by_scores(docs, self.score(query, docs), self.top_k)
+
+
+class TimeDecayRanker(ScoreRanker):
+    required_fields = frozenset(("score", "updated_at"))
+
+    def __init__(self, decay_rate: float = 1.8, top_k: int = 0) -> None:
         """
         Rank documents by time decay.
 
         The equation for time decay is derived from the HackerNews algorithm.
 
         $rank_score = score / ((hours_since_updated + 2) ** decay_rate)$
+
+        Args:
+            decay_rate: The gravity of the time decay.
+            top_k: The number of documents to return, 0 means all.
         """
-        self.decay_rate = decay_rate
+        self.decay_rate = float(decay_rate)
+        self.top_k = int(top_k)
 
-    def score(self, query: Record, docs: list[Record]) -> list[float]:
-        if not docs or docs[0].updated_at is None:
+    def score_columns(self, columns: Columns) -> np.ndarray:
+        if not len(columns) or columns.docs[0].updated_at is None:
             raise ValueError("doc `created_at` is required for time decay ranking")
-        current = datetime.now()
-        scores = [
-            record.score
-            / (
-                (2 + ((current - record.updated_at).total_seconds() / 3600.0))
-                ** self.decay_rate
-            )
-            for record in docs
-        ]
-        return scores
+        hours = columns.hours_since("updated_at", datetime.now())
+        return columns["score"] / ((2 + hours) ** self.decay_rate)
 
-    def rank(self, query: Record, docs: list[Record]) -> list[Record]:
-        scores = self.score(query, docs)
-        return [
-            doc
-            for (_, doc) in sorted(zip(scores, docs), key=lambda x: x[0], reverse=True)
-        ]
 
+class KeywordBoost(ScoreRanker):
+    required_fields = frozenset(("boost",))
 
-class KeywordBoost(Ranker):
-    def __init__(self, title_content_ratio: float = 0.7) -> None:
-        self.title_content_ratio = title_content_ratio
+    def __init__(self, title_content_ratio: float = 0.7, top_k: int = 0) -> None:
+        self.title_content_ratio = float(title_content_ratio)
+        self.top_k = int(top_k)
 
-    def score(self, query: Record, docs: list[Record]) -> list[float]:
-        """Higher score is better."""
-        if docs and docs[0].title_bm25:
-            scores = [
-                (
-                    doc.title_bm25 * self.title_content_ratio
-                    + doc.content_bm25 * (1 - self.title_content_ratio)
-                )
-                * doc.boost
-                for doc in docs
-            ]
-        else:
-            scores = [doc.content_bm25 * doc.boost for doc in docs]
-        return scores
+    def score_columns(self, columns: Columns) -> np.ndarray:
+        if len(columns) and columns.docs[0].title_bm25:
+            return (
+                columns["title_bm25"] * self.title_content_ratio
+                + columns["content_bm25"] * (1 - self.title_content_ratio)
+            ) * columns["boost"]
+        return columns["content_bm25"] * columns["boost"]
 
-    def rank(self, query: Record, docs: list[Record]) -> list[Record]:
-        scores = self.score(query, docs)
-        return [
-            doc
-            for (_, doc) in sorted(zip(scores, docs), key=lambda x: x[0], reverse=True)
-        ]
 
+class VectorBoost(ScoreRanker):
+    required_fields = frozenset(("boost",))
 
-class VectorBoost(Ranker):
-    def __init__(self, title_content_ratio: float = 0.7) -> None:
-        self.title_content_ratio = title_content_ratio
+    def __init__(self, title_content_ratio: float = 0.7, top_k: int = 0) -> None:
+        self.title_content_ratio = float(title_content_ratio)
+        self.top_k = int(top_k)
 
-    def score(self, query: Record, docs: list[Record]) -> list[float]:
-        """Higher score is better."""
-        if docs and docs[0].title_sim:
-            scores = [
-                doc.boost
-                / (
-                    doc.title_sim * self.title_content_ratio
-                    + doc.vector_sim * (1 - self.title_content_ratio)
-                )
-                for doc in docs
-            ]
-        else:
-            scores = [doc.boost / doc.vector_sim for doc in docs]
-        return scores
+    def score_columns(self, columns: Columns) -> np.ndarray:
+        if len(columns) and columns.docs[0].title_sim:
+            return columns["boost"] / (
+                columns["title_sim"] * self.title_content_ratio
+                + columns["vector_sim"] * (1 - self.title_content_ratio)
+            )
+        return columns["boost"] / columns["vector_sim"]
 
-    def rank(self, query: Record, docs: list[Record]) -> list[Record]:
-        scores = self.score(query, docs)
-        return [
-            doc
-            for (_, doc) in sorted(zip(scores, docs), key=lambda x: x[0], reverse=True)
-        ]
 
+class HybridRanker(ScoreRanker):
+    required_fields = frozenset(("score", "updated_at", "boost"))
 
-class HybridRanker(Ranker):
-    def __init__(self, decay_rate: float = 1.8, title_content_ratio: float = 0.7):
+    def __init__(
+        self, decay_rate: float = 1.8, title_content_ratio: float = 0.7, top_k: int = 0
+    ):
         self.decay_ranker = TimeDecayRanker(decay_rate)
         self.vector_ranker = VectorBoost(title_content_ratio)
         self.kw_ranker = KeywordBoost(title_content_ratio)
+        self.top_k = int(top_k)
+
+    def score_columns(self, columns: Columns) -> np.ndarray:
+        # the rankers share the columns, each field is only extracted once
+        return (
+            self.decay_ranker.score_columns(columns)
+            * self.vector_ranker.score_columns(columns)
+            * self.kw_ranker.score_columns(columns)
+        )
 
-    def score(self, query: Record, docs: list[Record]) -> list[float]:
-        decay_score = self.decay_ranker.score(query, docs)
-        vector_score = self.vector_ranker.score(query, docs)
-        kw_score = self.kw_ranker.score(query, docs)
-        return [
-            decay * vector * kw
-            for decay, vector, kw in zip(decay_score, vector_score, kw_score)
-        ]
 
-    def rank(self, query: Record, docs: list[Record]) -> list[Record]:
-        scores = self.score(query, docs)
-        return [
-            doc
-            for (_, doc) in sorted(zip(scores, docs), key=lambda x: x[0], reverse=True)
-        ]
+class RRFRanker(ScoreRanker):
+    # only uses the retrieval positions, no extra column is required
+    required_fields = frozenset()
+
+    def __init__(  # noqa: PLR0913
+        self,
+        k: float = 60,
+        vector_weight: float = 1.0,
+        sparse_weight: float = 1.0,
+        text_weight: float = 1.0,
+        top_k: int = 0,
+    ) -> None:
+        """
+        Rank documents by the (weighted) reciprocal rank fusion of the retrieval.
+
+        Link: https://plg.uwaterloo.ca/~gvcormac/cormacksigir09-rrf.pdf
+
+        $rank_score = sum(weight / (k + position))$, the position starts from 1
+        and the missing retrieval contributes 0.
+
+        Args:
+            k: The constant to smooth the top positions, 60 in the paper.
+            vector_weight, sparse_weight, text_weight: The weight of each retrieval.
+            top_k: The number of documents to return, 0 means all.
+        """
+        self.k = float(k)
+        self.weights = np.array(
+            [float(vector_weight), float(sparse_weight), float(text_weight)]
+        )
+        self.top_k = int(top_k)
+
+    def score_columns(self, columns: Columns) -> np.ndarray:
+        # `None` becomes NaN, which is ignored by `nansum`
+        positions = np.array(
+            [(doc.vector_pos, doc.sparse_pos, doc.text_pos) for doc in columns.docs],
+            dtype=np.float64,
+        ).reshape(-1, 3)
+        return np.nansum(self.weights / (self.k + 1 + positions), axis=1)
 
 
 class ReRanker:
-    def __init__(self, steps: list[Ranker]) -> None:
+    def __init__(
+        self,
+        steps: list[Ranker],
+        keep: list[int] | None = None,
+        margin: list[float] | None = None,
+    ) -> None:
+        """
+        Rank documents with a cascade of rankers, the cheaper ones should go first.
+
+        Args:
+            steps: The rankers to run in order.
+            keep: The number of documents passed to the next step after each step,
+                0 means all. The expensive steps only score the survivors.
+            margin: Stop the cascade after a step if its top score exceeds the
+                second one by this margin, 0 disables it. This only works for the
+                rankers with scores.
+        """
         if not steps:
             raise ValueError("At least one ranker is required")
+        keep = keep or [0] * len(steps)
+        margin = margin or [0.0] * len(steps)
+        if len(keep) != len(steps) or len(margin) != len(steps):
+            raise ValueError("`keep` and `margin` must match the number of steps")
         self.steps = steps
+        self.keep = keep
+        self.margin = margin
+
+    @property
+    def required_fields(self) -> frozenset[str] | None:
+        if any(step.required_fields is None for step in self.steps):
+            return None
+        return frozenset().union(*(step.required_fields for step in self.steps))
+
+    @property
+    def remote(self) -> bool:
+        return any(step.remote for step in self.steps)
+
+    @property
+    def inline(self) -> bool:
+        return all(step.inline for step in self.steps)
+
+    def cut(
+        self, i: int, docs: list[Record], scores: np.ndarray | None
+    ) -> tuple[list[Record], bool]:
+        """Keep the survivors of the step `i`, and check if the cascade can stop."""
+        if self.keep[i]:
+            docs = docs[: self.keep[i]]
+        decisive = (
+            self.margin[i] > 0
+            and scores is not None
+            and len(scores) > 1
+            and scores[0] - scores[1] >= self.margin[i]
+        )
+        if decisive and i + 1 < len(self.steps):
+            logger.debug("rerank stopped after the decisive step %d", i)
+        return docs, decisive
 
     def rank_records(self, query: Record, docs: list[Record]) -> list[Record]:
-        for step in self.steps:
-            docs = step.rank(query, docs)
+        for i, step in enumerate(self.steps):
+            with rerank_stage_histogram.labels(type(step).__name__).time():
+                docs, scores = step.rank_with_scores(query, docs)
+            docs, decisive = self.cut(i, docs, scores)
+            if decisive:
+                break
+        return docs
+
+    async def arank(self, query: Record, docs: list[Record]) -> list[Record]:
+        for i, step in enumerate(self.steps):
+            with rerank_stage_histogram.labels(type(step).__name__).time():
+                docs, scores = await step.arank_with_scores(query, docs)
+            docs, decisive = self.cut(i, docs, scores)
+            if decisive:
+                break
         return docs
 
     @overload
@@ -2,7 +2,7 @@ from __future__ import annotations
 
 from dataclasses import dataclass, field, fields
 from datetime import datetime
-from typing import Type
+from typing import Iterable, Type
 
 import msgspec
 from msgspec import NODEFAULT
@@ -19,7 +19,7 @@ from msgspec.inspect import (
 )
 from psycopg import sql
 
-from qtext.spec import Record, SparseEmbedding
+from qtext.spec import MetadataFilter, Record, SparseArray, SparseEmbedding
 
 
 @dataclass(kw_only=True)
@@ -74,8 +74,19 @@ class DefaultTable:
 
 
 class Querier:
-    def __init__(self, table: Type[DefaultTable]) -> None:
+    def __init__(
+        self, table: Type[DefaultTable], required_fields: Iterable[str] | None = None
+    ) -> None:
+        """
+        Args:
+            table: The table schema.
+            required_fields: The record fields required by the ranker. `None` means
+                all the columns should be selected.
+        """
         self.table_type = table
+        self.required_fields = (
+            None if required_fields is None else frozenset(required_fields)
+        )
         self.fields: list[Field] = msgspec.inspect.type_info(table).fields
         self.primary_key: str | None = None
         self.vector_column: str | None = None
@@ -110,13 +121,27 @@ class Querier:
 
         return Response
 
+    def generate_hybrid_response_class(self) -> DefaultTable:
+        """Generate the class used by the raw dict data from the hybrid query."""
+
+        @dataclass(kw_only=True)
+        class HybridResponse(self.table_type):
+            vector_rank: float | None = None
+            sparse_rank: float | None = None
+            text_rank: float | None = None
+            vector_pos: int | None = None
+            sparse_pos: int | None = None
+            text_pos: int | None = None
+
+        return HybridResponse
+
     def fill_vector(self, obj, vector: list[float]):
         setattr(obj, self.vector_column, vector)
 
     def retrieve_vector(self, obj):
         return getattr(obj, self.vector_column)
 
-    def fill_sparse_vector(self, obj, sparse: SparseEmbedding):
+    def fill_sparse_vector(self, obj, sparse: SparseEmbedding | SparseArray):
         setattr(obj, self.sparse_column, sparse)
 
     def retrieve_sparse_vector(self, obj):
@@ -133,25 +158,45 @@ class Querier:
     ) -> list[Record]:
         """Combine hybrid search results."""
         id_to_record = {}
-        for vec in vec_res:
+        for pos, vec in enumerate(vec_res):
             record = vec.to_record()
             record.vector_sim = vec.rank
+            record.vector_pos = pos
             id_to_record[record.id] = record
 
-        for sparse in sparse_res:
+        for pos, sparse in enumerate(sparse_res):
             record = sparse.to_record()
             if record.id not in id_to_record:
                 id_to_record[record.id] = record
             id_to_record[record.id].title_sim = sparse.rank
+            id_to_record[record.id].sparse_pos = pos
 
-        for text in text_res:
+        for pos, text in enumerate(text_res):
             record = text.to_record()
             if record.id not in id_to_record:
                 id_to_record[record.id] = record
             id_to_record[record.id].content_bm25 = text.rank
+            id_to_record[record.id].text_pos = pos
 
         return list(id_to_record.values())
 
+    def combine_hybrid(self, hybrid_res: list[DefaultTable]) -> list[Record]:
+        """Convert the hybrid query results, the same as `combine_vector_text`."""
+        records = []
+        for hybrid in hybrid_res:
+            record = hybrid.to_record()
+            if hybrid.vector_rank is not None:
+                record.vector_sim = hybrid.vector_rank
+            if hybrid.sparse_rank is not None:
+                record.title_sim = hybrid.sparse_rank
+            if hybrid.text_rank is not None:
+                record.content_bm25 = hybrid.text_rank
+            record.vector_pos = hybrid.vector_pos
+            record.sparse_pos = hybrid.sparse_pos
+            record.text_pos = hybrid.text_pos
+            records.append(record)
+        return records
+
     @staticmethod
     def to_pg_type(field_type: msgspec.inspect.Type) -> str:
         if isinstance(field_type, UnionType):
@@ -266,42 +311,294 @@ class Querier:
             indexed_columns=indexed_columns,
         )
 
-    def vector_query(self, table: str) -> sql.SQL:
-        columns = sql.SQL(", ").join(sql.Identifier(f.name) for f in self.fields)
+    def filter_clause(self, metadata: MetadataFilter | None) -> sql.Composable | None:
+        """
+        Compile the metadata filter to the conditions joined by `AND`. The values
+        are named placeholders filled by `filter_params`.
+        """
+        if metadata is None:
+            return None
+        columns = {f.name: f for f in self.fields}
+        for column in metadata.columns():
+            if column not in columns:
+                raise ValueError(f"unknown filter column `{column}`")
+
+        conditions = []
+        index = 0
+        for operator, values in (
+            ("=", metadata.equal),
+            (">=", metadata.gte),
+            ("<=", metadata.lte),
+        ):
+            for column in values:
+                conditions.append(
+                    sql.SQL("{column} {operator} {value}").format(
+                        column=sql.Identifier(column),
+                        operator=sql.SQL(operator),
+                        value=sql.Placeholder(f"filter_{index}"),
+                    )
+                )
+                index += 1
+        for column, values in metadata.contains.items():
+            # build the array from the elements since `list` is dumped as a vector
+            elements = []
+            for _ in values:
+                elements.append(sql.Placeholder(f"filter_{index}"))
+                index += 1
+            conditions.append(
+                sql.SQL("{column} @> ARRAY[{elements}]::{array_type}").format(
+                    column=sql.Identifier(column),
+                    elements=sql.SQL(", ").join(elements),
+                    array_type=sql.SQL(Querier.to_pg_type(columns[column].type)),
+                )
+            )
+        if not conditions:
+            return None
+        return sql.SQL(" AND ").join(conditions)
+
+    @staticmethod
+    def filter_params(metadata: MetadataFilter | None) -> dict:
+        """The values of the placeholders in `filter_clause`."""
+        if metadata is None:
+            return {}
+        values = [
+            *metadata.equal.values(),
+            *metadata.gte.values(),
+            *metadata.lte.values(),
+        ]
+        for elements in metadata.contains.values():
+            values.extend(elements)
+        return {f"filter_{i}": value for i, value in enumerate(values)}
+
+    @staticmethod
+    def where(condition: sql.Composable | None, prefix: str = "WHERE") -> sql.SQL:
+        if condition is None:
+            return sql.SQL("")
+        return sql.SQL(f"{prefix} {{condition}} ").format(condition=condition)
+
+    def vector_query(
+        self,
+        table: str,
+        columns: list[str] | None = None,
+        metadata: MetadataFilter | None = None,
+    ) -> sql.SQL:
+        """Parameters are named as `vector` and `limit`."""
+        columns = sql.SQL(", ").join(map(sql.Identifier, columns or self.columns()))
         return sql.SQL(
-            "SELECT {columns}, {vector_column} <#> %s AS rank "
-            "FROM {table} ORDER by rank LIMIT %s;"
+            "SELECT {columns}, {vector_column} <#> %(vector)s AS rank "
+            "FROM {table} {where}ORDER by rank LIMIT %(limit)s;"
         ).format(
             table=sql.Identifier(table),
             columns=columns,
             vector_column=sql.Identifier(self.vector_column),
+            where=self.where(self.filter_clause(metadata)),
         )
 
-    def sparse_query(self, table: str) -> sql.SQL:
-        columns = sql.SQL(", ").join(sql.Identifier(f.name) for f in self.fields)
+    def sparse_query(
+        self,
+        table: str,
+        columns: list[str] | None = None,
+        metadata: MetadataFilter | None = None,
+    ) -> sql.SQL:
+        """Parameters are named as `sparse_vector` and `limit`."""
+        columns = sql.SQL(", ").join(map(sql.Identifier, columns or self.columns()))
         return sql.SQL(
-            "SELECT {columns}, {sparse_column} <#> %s AS rank "
-            "FROM {table} ORDER by rank LIMIT %s;"
+            "SELECT {columns}, {sparse_column} <#> %(sparse_vector)s AS rank "
+            "FROM {table} {where}ORDER by rank LIMIT %(limit)s;"
         ).format(
             table=sql.Identifier(table),
             columns=columns,
             sparse_column=sql.Identifier(self.sparse_column),
+            where=self.where(self.filter_clause(metadata)),
         )
 
-    def text_query(self, table: str) -> sql.SQL:
-        columns = sql.SQL(", ").join(sql.Identifier(f.name) for f in self.fields)
+    def text_query(
+        self,
+        table: str,
+        columns: list[str] | None = None,
+        metadata: MetadataFilter | None = None,
+    ) -> sql.SQL:
+        """Parameters are named as `query` and `limit`."""
+        columns = sql.SQL(", ").join(map(sql.Identifier, columns or self.columns()))
         return sql.SQL(
             "SELECT {columns}, ts_rank_cd(fts_vector, query) AS rank "
-            "FROM {table}, to_tsquery(%s) query "
-            "WHERE fts_vector @@ query order by rank desc LIMIT %s;"
+            "FROM {table}, to_tsquery(%(query)s) query "
+            "WHERE fts_vector @@ query {where}order by rank desc LIMIT %(limit)s;"
         ).format(
             table=sql.Identifier(table),
             columns=columns,
+            where=self.where(self.filter_clause(metadata), prefix="AND"),
+        )
+
+    def hybrid_query(
+        self,
+        table: str,
+        columns: list[str] | None = None,
+        metadata: MetadataFilter | None = None,
+    ) -> sql.SQL:
+        """
+        Query all the indexes in one statement, each doc is returned once with the
+        rank and the 0-based position of each index (NULL if it's not retrieved by
+        that index).
+
+        This requires the primary key to join the results. Parameters are named as
+        `vector`, `sparse_vector`, `query` and `limit`.
+        """
+        if self.primary_key is None:
+            raise ValueError("primary key is required by the hybrid query")
+        legs = []
+        if self.has_vector_index():
+            legs.append(
+                (
+                    "vector",
+                    "SELECT {primary_key}, {vector_column} <#> %(vector)s AS rank "
+                    "FROM {table} {where}ORDER BY rank LIMIT %(limit)s",
+                )
+            )
+        if self.has_sparse_index():
+            legs.append(
+                (
+                    "sparse",
+                    "SELECT {primary_key}, {sparse_column} <#> %(sparse_vector)s AS rank "
+                    "FROM {table} {where}ORDER BY rank LIMIT %(limit)s",
+                )
+            )
+        if self.has_text_index():
+            legs.append(
+                (
+                    "text",
+                    "SELECT {primary_key}, ts_rank_cd(fts_vector, query) AS rank "
+                    "FROM {table}, to_tsquery(%(query)s) query "
+                    "WHERE fts_vector @@ query {and_where}"
+                    "ORDER BY rank DESC LIMIT %(limit)s",
+                )
+            )
+        if not legs:
+            raise ValueError("at least one index is required by the hybrid query")
+
+        condition = self.filter_clause(metadata)
+        identifiers = {
+            "table": sql.Identifier(table),
+            "primary_key": sql.Identifier(self.primary_key),
+            "vector_column": sql.Identifier(self.vector_column or ""),
+            "sparse_column": sql.Identifier(self.sparse_column or ""),
+        }
+        # number the rows after the LIMIT, or the window needs all the matched rows
+        ctes = sql.SQL(", ").join(
+            sql.SQL(
+                "{leg} AS (SELECT *, ROW_NUMBER() OVER (ORDER BY rank {order}) - 1 "
+                "AS pos FROM ({query}) AS {top})"
+            ).format(
+                leg=sql.Identifier(f"{name}_leg"),
+                top=sql.Identifier(f"{name}_top"),
+                order=sql.SQL("DESC" if name == "text" else "ASC"),
+                query=sql.SQL(query).format(
+                    where=self.where(condition),
+                    and_where=self.where(condition, prefix="AND"),
+                    **identifiers,
+                ),
+            )
+            for name, query in legs
+        )
+        joined = sql.Identifier(f"{legs[0][0]}_leg")
+        for name, _ in legs[1:]:
+            joined = sql.SQL(
+                "{joined} FULL OUTER JOIN {leg} USING ({primary_key})"
+            ).format(
+                joined=joined,
+                leg=sql.Identifier(f"{name}_leg"),
+                primary_key=identifiers["primary_key"],
+            )
+        columns = sql.SQL(", ").join(
+            sql.Identifier(table, column) for column in columns or self.columns()
+        )
+        ranks = sql.SQL(", ").join(
+            sql.SQL("{leg}.rank AS {rank}, {leg}.pos AS {pos}").format(
+                leg=sql.Identifier(f"{name}_leg"),
+                rank=sql.Identifier(f"{name}_rank"),
+                pos=sql.Identifier(f"{name}_pos"),
+            )
+            for name, _ in legs
+        )
+        # the best position first, ties are broken by the primary key
+        positions = sql.SQL(", ").join(
+            sql.SQL("{leg}.pos").format(leg=sql.Identifier(f"{name}_leg"))
+            for name, _ in legs
+        )
+        return sql.SQL(
+            "WITH {ctes} SELECT {columns}, {ranks} "
+            "FROM {joined} JOIN {table} USING ({primary_key}) "
+            "ORDER BY LEAST({positions}) NULLS LAST, {table}.{primary_key};"
+        ).format(
+            ctes=ctes,
+            columns=columns,
+            ranks=ranks,
+            joined=joined,
+            positions=positions,
+            **identifiers,
         )
 
     def columns(self) -> list[str]:
         return list(f.name for f in self.fields)
 
+    def projection(self, fields: Iterable[str] | None = None) -> list[str]:
+        """
+        Columns to select. The vectors are only selected when they're required by
+        the ranker. The user `fields` can trim other optional columns.
+        """
+        if self.required_fields is None:
+            return self.columns()
+        required = set(self.required_fields)
+        if "vector" in required and self.vector_column:
+            required.add(self.vector_column)
+        if "sparse_vector" in required and self.sparse_column:
+            required.add(self.sparse_column)
+        fields = None if fields is None else set(fields)
+
+        columns = []
+        for f in self.fields:
+            if f.name == self.primary_key or f.required or f.name in required:
+                columns.append(f.name)
+            elif f.name in (self.vector_column, self.sparse_column):
+                continue
+            elif fields is None or f.name in fields:
+                columns.append(f.name)
+        return columns
+
+    def insert_columns(self, obj) -> list[str]:
+        """Columns to insert, the primary key is generated by postgres if absent."""
+        attributes = self.columns()
+        if self.primary_key is not None and getattr(obj, self.primary_key) is None:
+            attributes.remove(self.primary_key)
+        return attributes
+
+    def column_types(self, columns: list[str]) -> list[str]:
+        """Postgres type names of the columns, used by the binary COPY."""
+        types = {}
+        for f in self.fields:
+            if f.name == self.primary_key:
+                types[f.name] = "integer"
+            elif f.name == self.vector_column:
+                types[f.name] = "vector"
+            elif f.name == self.sparse_column:
+                types[f.name] = "svector"
+            else:
+                types[f.name] = Querier.to_pg_type(f.type).lower()
+        return [types[column] for column in columns]
+
+    def insert_query(self, table: str, columns: list[str]) -> sql.SQL:
+        return sql.SQL("INSERT INTO {table} ({fields}) VALUES ({placeholders})").format(
+            table=sql.Identifier(table),
+            fields=sql.SQL(",").join(map(sql.Identifier, columns)),
+            placeholders=sql.SQL(",").join(sql.Placeholder() for _ in columns),
+        )
+
+    def copy_query(self, table: str, columns: list[str]) -> sql.SQL:
+        return sql.SQL("COPY {table} ({fields}) FROM STDIN (FORMAT BINARY)").format(
+            table=sql.Identifier(table),
+            fields=sql.SQL(",").join(map(sql.Identifier, columns)),
+        )
+
 
 if __name__ == "__main__":
     search = Querier(DefaultTable)
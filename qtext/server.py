@@ -7,20 +7,36 @@ from falcon import App, Request, Response
 from prometheus_client import REGISTRY
 from prometheus_client.openmetrics import exposition as openmetrics
 
+from qtext.breaker import CircuitOpenError
 from qtext.engine import RetrievalEngine
+from qtext.ingest import IngestQueueFullError
 from qtext.log import logger
 from qtext.spec import (
     AddNamespaceRequest,
     HighlightRequest,
     HighlightResponse,
+    IngestResponse,
+    IngestTicket,
     QueryDocRequest,
     QueryExplainResponse,
 )
 from qtext.utils import msgspec_encode_np
 
+# RFC 9211 `Cache-Status` of the query result cache
+CACHE_STATUS = "Cache-Status"
+CACHE_HIT = "qtext; hit"
+CACHE_MISS = "qtext; fwd=miss; stored"
+# the query steps skipped by the deadline
+SKIPPED = "Qtext-Skipped"
+
 
 def validate_request(spec: type[msgspec.Struct], req: Request, resp: Response):
-    buf = req.stream.read()
+    return decode_request(spec, req.stream.read(), req, resp)
+
+
+def decode_request(
+    spec: type[msgspec.Struct], buf: bytes, req: Request, resp: Response
+):
     try:
         request = msgspec.json.decode(buf, type=spec)
     except (msgspec.ValidationError, msgspec.DecodeError) as err:
@@ -34,6 +50,16 @@ def validate_request(spec: type[msgspec.Struct], req: Request, resp: Response):
     return request
 
 
+def encode_docs(docs: list, fields: list[str] | None = None) -> bytes:
+    """Encode the docs, only keep the `fields` if provided."""
+    if fields is not None:
+        docs = [
+            {field: getattr(doc, field) for field in fields if hasattr(doc, field)}
+            for doc in docs
+        ]
+    return msgspec.json.encode(docs, enc_hook=msgspec_encode_np)
+
+
 def uncaught_exception_handler(
     req: Request, resp: Response, exc: Exception, params: dict
 ):
@@ -45,6 +71,12 @@ def uncaught_exception_handler(
     raise falcon.HTTPError(falcon.HTTP_500)
 
 
+def circuit_open_handler(
+    req: Request, resp: Response, exc: CircuitOpenError, params: dict
+):
+    raise falcon.HTTPServiceUnavailable(description=str(exc), retry_after=1)
+
+
 class HealthCheck:
     def on_get(self, req: Request, resp: Response):
         resp.status = falcon.HTTP_200
@@ -61,7 +93,45 @@ class DocResource:
         if request is None:
             return
 
-        self.engine.add_doc(request)
+        if self.engine.ingest_queue is None:
+            self.engine.add_doc(request)
+            return
+
+        try:
+            ticket = self.engine.ingest_queue.submit(request)
+        except IngestQueueFullError as err:
+            raise falcon.HTTPServiceUnavailable(
+                description=str(err), retry_after=1
+            ) from err
+        resp.status = falcon.HTTP_202
+        resp.data = msgspec.json.encode(IngestResponse(ticket=ticket))
+        resp.content_type = falcon.MEDIA_JSON
+
+
+class IngestStatusResource:
+    def __init__(self, engine: RetrievalEngine) -> None:
+        self.engine = engine
+
+    def on_get(self, req: Request, resp: Response, ticket: str):
+        if self.engine.ingest_queue is None:
+            raise falcon.HTTPNotFound(description="the ingest queue is disabled")
+        status = self.engine.ingest_queue.status(ticket)
+        if status is None:
+            raise falcon.HTTPNotFound(description=f"unknown ticket {ticket}")
+        resp.data = msgspec.json.encode(IngestResponse(ticket=ticket, status=status))
+        resp.content_type = falcon.MEDIA_JSON
+
+
+class DocsResource:
+    def __init__(self, engine: RetrievalEngine) -> None:
+        self.engine = engine
+
+    def on_post(self, req: Request, resp: Response):
+        request = validate_request(list[self.engine.req_cls], req, resp)
+        if request is None:
+            return
+
+        self.engine.add_docs(request)
 
 
 class QueryResource:
@@ -73,8 +143,21 @@ class QueryResource:
         if request is None:
             return
 
-        docs = self.engine.query(request)
-        resp.data = msgspec.json.encode(docs, enc_hook=msgspec_encode_np)
+        cache = self.engine.result_cache
+        key = self.engine.result_key(request) if cache.enabled else None
+        data = cache.get(key)
+        if data is not None:
+            resp.set_header(CACHE_STATUS, CACHE_HIT)
+        else:
+            docs, skipped = self.engine.search(request)
+            data = encode_docs(docs, request.fields)
+            if skipped:
+                # the degraded results are not cached
+                resp.set_header(SKIPPED, ", ".join(skipped))
+            elif cache.enabled:
+                cache.put(key, data)
+                resp.set_header(CACHE_STATUS, CACHE_MISS)
+        resp.data = data
         resp.content_type = falcon.MEDIA_JSON
 
 
@@ -126,7 +209,24 @@ class OpenAPIResource:
             request_type=AddNamespaceRequest,
         )
         self.openapi.register_route(
-            "/api/doc", "post", "Add a document", request_type=engine.req_cls
+            "/api/doc",
+            "post",
+            "Add a document, it's queued if the ingest queue is enabled",
+            request_type=engine.req_cls,
+            response_type=IngestResponse,
+        )
+        self.openapi.register_route(
+            "/api/doc/{ticket}",
+            "get",
+            "Get the status of a queued document",
+            path_type=IngestTicket,
+            response_type=IngestResponse,
+        )
+        self.openapi.register_route(
+            "/api/docs",
+            "post",
+            "Add a batch of documents",
+            request_type=list[engine.req_cls],
         )
         self.openapi.register_route(
             "/api/query",
@@ -177,6 +277,8 @@ def create_app(engine: RetrievalEngine) -> App:
     app.add_route("/metrics", OpenMetrics())
     app.add_route("/api/namespace", NamespaceResource(engine))
     app.add_route("/api/doc", DocResource(engine))
+    app.add_route("/api/docs", DocsResource(engine))
+    app.add_route("/api/doc/{ticket}", IngestStatusResource(engine))
     app.add_route("/api/query", QueryResource(engine))
     app.add_route("/api/query_explain", QueryExplainResource(engine))
     app.add_route("/api/highlight", HighlightResource(engine))
@@ -191,4 +293,5 @@ def create_app(engine: RetrievalEngine) -> App:
         "/openapi/scalar", OpenAPIRender("/openapi/spec.json", RenderTemplate.SCALAR)
     )
     app.add_error_handler(Exception, uncaught_exception_handler)
+    app.add_error_handler(CircuitOpenError, circuit_open_handler)
     return app
@@ -2,6 +2,8 @@ from __future__ import annotations
 
 import struct
 from datetime import datetime
+from enum import Enum
+from typing import Annotated
 
 import msgspec
 import numpy as np
@@ -25,6 +27,10 @@ class Record(msgspec.Struct, kw_only=True):
     tags: list[str] | None = None
     hidden: bool = False
     boost: float = 1.0
+    # 0-based positions in the vector, sparse and text retrieval, `None` if absent
+    vector_pos: int | None = None
+    sparse_pos: int | None = None
+    text_pos: int | None = None
 
     def use_np(self):
         if isinstance(self.vector, list):
@@ -68,21 +74,156 @@ class SparseEmbedding(msgspec.Struct, kw_only=True, frozen=True):
         return f"[{','.join(map(str, dense))}]"
 
     def to_bytes(self) -> bytes:
-        return struct.pack(
-            f"<II{len(self.indices)}I{len(self.values)}f",
-            self.dim,
-            len(self.indices),
-            *self.indices,
-            *self.values,
+        return b"".join(
+            (
+                struct.pack("<II", self.dim, len(self.indices)),
+                np.asarray(self.indices, dtype="<u4").tobytes(),
+                np.asarray(self.values, dtype="<f4").tobytes(),
+            )
         )
 
     @classmethod
     def from_bytes(cls, buf: bytes) -> SparseEmbedding:
-        dim = struct.unpack_from("<I", buf)[0]
-        length = struct.unpack_from("<I", buf, 4)[0]
-        indices = struct.unpack_from(f"<{length}I", buf, 8)
-        values = struct.unpack_from(f"<{length}f", buf, 8 + 4 * length)
-        return SparseEmbedding(dim=dim, indices=list(indices), values=list(values))
+        dim, length = struct.unpack_from("<II", buf)
+        indices = np.frombuffer(buf, dtype="<u4", count=length, offset=8)
+        values = np.frombuffer(buf, dtype="<f4", count=length, offset=8 + 4 * length)
+        return SparseEmbedding(
+            dim=dim, indices=indices.tolist(), values=values.tolist()
+        )
+
+
+class SparseArray:
+    """NumPy-backed sparse embedding.
+
+    It has the same wire format and JSON/msgpack encoding (with `msgspec_encode_np`)
+    as the `SparseEmbedding`, but the indices and values are kept in contiguous
+    arrays, so decoding, validation and the dot product don't create Python objects
+    for each element.
+    """
+
+    __slots__ = ("dim", "indices", "values")
+
+    def __init__(self, dim: int, indices, values, validate: bool = True) -> None:
+        self.dim = dim
+        if validate:
+            indices = np.asarray(indices)
+            # check before the cast, or the negative ones raise `OverflowError`
+            if indices.size and (indices < 0).any():
+                raise ValueError("indices must be non-negative")
+        self.indices = np.asarray(indices, dtype="<u4")
+        self.values = np.asarray(values, dtype="<f4")
+        if validate:
+            self.validate()
+
+    def validate(self):
+        """Check the length and uniqueness, sort by the indices if required."""
+        if self.indices.ndim != 1 or self.indices.shape != self.values.shape:
+            raise ValueError("indices and values must have the same length")
+        diff = np.diff(self.indices.astype(np.int64))
+        if (diff > 0).all():
+            return
+        order = np.argsort(self.indices, kind="stable")
+        self.indices, self.values = self.indices[order], self.values[order]
+        if (np.diff(self.indices.astype(np.int64)) == 0).any():
+            raise ValueError("indices must be unique")
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, SparseEmbedding):
+            other = SparseArray.from_embedding(other)
+        if not isinstance(other, SparseArray):
+            return NotImplemented
+        return (
+            self.dim == other.dim
+            and np.array_equal(self.indices, other.indices)
+            and np.array_equal(self.values, other.values)
+        )
+
+    def __repr__(self) -> str:
+        return (
+            f"SparseArray(dim={self.dim}, indices={self.indices.tolist()}, "
+            f"values={self.values.tolist()})"
+        )
+
+    def dot(self, other: SparseArray | np.ndarray) -> float:
+        """Inner product with another sparse array or a dense vector."""
+        if isinstance(other, np.ndarray):
+            return float(self.values @ other[self.indices])
+        _, left, right = np.intersect1d(
+            self.indices, other.indices, assume_unique=True, return_indices=True
+        )
+        return float(self.values[left] @ other.values[right])
+
+    def to_dense(self) -> np.ndarray:
+        dense = np.zeros(self.dim, dtype=np.float32)
+        dense[self.indices] = self.values
+        return dense
+
+    def to_str(self) -> str:
+        return f"[{','.join(map(str, self.to_dense()))}]"
+
+    def to_dict(self) -> dict:
+        return {
+            "dim": self.dim,
+            "indices": self.indices.tolist(),
+            "values": self.values.tolist(),
+        }
+
+    def to_embedding(self) -> SparseEmbedding:
+        return SparseEmbedding(
+            dim=self.dim, indices=self.indices.tolist(), values=self.values.tolist()
+        )
+
+    @classmethod
+    def from_embedding(cls, sparse: SparseEmbedding) -> SparseArray:
+        return cls(sparse.dim, sparse.indices, sparse.values, validate=False)
+
+    def to_bytes(self) -> bytes:
+        return b"".join(
+            (
+                struct.pack("<II", self.dim, len(self.indices)),
+                self.indices.tobytes(),
+                self.values.tobytes(),
+            )
+        )
+
+    @classmethod
+    def from_bytes(cls, buf: bytes) -> SparseArray:
+        """Decode without copying, the svector from postgres is already sorted."""
+        dim, length = struct.unpack_from("<II", buf)
+        indices = np.frombuffer(buf, dtype="<u4", count=length, offset=8)
+        values = np.frombuffer(buf, dtype="<f4", count=length, offset=8 + 4 * length)
+        return cls(dim, indices, values, validate=False)
+
+
+class MetadataFilter(msgspec.Struct, kw_only=True, frozen=True):
+    """Filter the docs by columns, all the conditions are combined with `AND`.
+
+    The datetime values can be provided as ISO 8601 strings.
+    """
+
+    # column = value
+    equal: dict[str, str | int | float | bool] = msgspec.field(default_factory=dict)
+    # column >= value
+    gte: dict[str, str | int | float] = msgspec.field(default_factory=dict)
+    # column <= value
+    lte: dict[str, str | int | float] = msgspec.field(default_factory=dict)
+    # array column contains all the values
+    contains: dict[str, list[str]] = msgspec.field(default_factory=dict)
+
+    def columns(self) -> set[str]:
+        return {*self.equal, *self.gte, *self.lte, *self.contains}
+
+    def shape(self) -> tuple:
+        """The filter without the values, it decides the compiled SQL."""
+        return (
+            tuple(self.equal),
+            tuple(self.gte),
+            tuple(self.lte),
+            tuple((column, len(values)) for column, values in self.contains.items()),
+        )
 
 
 class QueryDocRequest(msgspec.Struct, kw_only=True):
@@ -91,7 +232,11 @@ class QueryDocRequest(msgspec.Struct, kw_only=True):
     limit: int = 10
     vector: list[float] | None = None
     sparse_vector: SparseEmbedding | None = None
-    metadata: dict | None = None
+    metadata: MetadataFilter | None = None
+    # only return these fields of the docs
+    fields: list[str] | None = None
+    # seconds to finish the query, the late retrieval or rerank are skipped
+    deadline: Annotated[float, msgspec.Meta(gt=0)] | None = None
 
     def to_record(self) -> Record:
         return Record(
@@ -136,6 +281,8 @@ class QueryExplainResponse(msgspec.Struct, kw_only=True):
     sparse: RetrieveResponse = msgspec.field(default_factory=RetrieveResponse)
     text: RetrieveResponse = msgspec.field(default_factory=RetrieveResponse)
     ranked: RankedResponse = msgspec.field(default_factory=RankedResponse)
+    # the retrieval legs or the rerank skipped by the deadline
+    skipped: list[str] = msgspec.field(default_factory=list)
 
 
 class AddNamespaceRequest(msgspec.Struct, frozen=True, kw_only=True):
@@ -144,6 +291,21 @@ class AddNamespaceRequest(msgspec.Struct, frozen=True, kw_only=True):
     sparse_vector_dim: int = 0
 
 
+class IngestStatus(Enum):
+    QUEUED = "queued"
+    DONE = "done"
+    FAILED = "failed"
+
+
+class IngestTicket(msgspec.Struct, kw_only=True, frozen=True):
+    ticket: str
+
+
+class IngestResponse(msgspec.Struct, kw_only=True):
+    ticket: str
+    status: IngestStatus = IngestStatus.QUEUED
+
+
 class HighlightRequest(msgspec.Struct, kw_only=True, frozen=True):
     query: str
     docs: list[str]
@@ -1,12 +1,29 @@
+import inspect
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 from functools import wraps
 from time import perf_counter
+from typing import Iterator
 
 import numpy as np
 
 from qtext.log import logger
+from qtext.spec import SparseArray
 
 
 def time_it(func):
+    if inspect.iscoroutinefunction(func):
+
+        @wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            t0 = perf_counter()
+            result = await func(*args, **kwargs)
+            logger.debug("%s took %s s", func.__name__, perf_counter() - t0)
+            return result
+
+        return async_wrapper
+
     @wraps(func)
     def wrapper(*args, **kwargs):
         t0 = perf_counter()
@@ -17,7 +34,87 @@ def time_it(func):
     return wrapper
 
 
+def timed(func, *args, **kwargs):
+    """Return the result with the elapsed seconds."""
+    t0 = perf_counter()
+    result = func(*args, **kwargs)
+    return result, perf_counter() - t0
+
+
+class Deadline:
+    """The time budget of a request, there is no limit if `seconds` is falsy."""
+
+    def __init__(self, seconds: float | None = None) -> None:
+        self.end = perf_counter() + seconds if seconds else None
+
+    def remaining(self) -> float | None:
+        """The seconds left, `None` means no limit."""
+        if self.end is None:
+            return None
+        return max(self.end - perf_counter(), 0.0)
+
+    def expired(self) -> bool:
+        return self.end is not None and perf_counter() >= self.end
+
+
+class DeadlineExceededError(TimeoutError):
+    """The call ran out of the request budget, this is not the dependency's fault."""
+
+
+class BoundedExecutor:
+    """A thread pool that rejects the calls instead of queueing them.
+
+    `submit` returns `None` when all the `max_workers` threads are busy, so a slow
+    dependency cannot hold the threads of the others or pile up late calls.
+    """
+
+    def __init__(self, name: str, max_workers: int) -> None:
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix=f"qtext-{name}"
+        )
+        self.slots = threading.BoundedSemaphore(max_workers)
+
+    def release(self, _: Future):
+        self.slots.release()
+
+    def submit(self, func, *args) -> Future | None:
+        if not self.slots.acquire(blocking=False):
+            return None
+        try:
+            future = self.executor.submit(func, *args)
+        except Exception:
+            self.slots.release()
+            raise
+        future.add_done_callback(self.release)
+        return future
+
+
+def batched(items: list, size: int) -> Iterator[list]:
+    """Split the list into chunks with at most `size` items."""
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+def take_batch(items: queue.Queue, size: int, linger: float) -> list:
+    """Block for the first item, then wait `linger` seconds to fill the batch."""
+    batch = [items.get()]
+    deadline = perf_counter() + linger
+    while len(batch) < size:
+        timeout = deadline - perf_counter()
+        try:
+            if timeout <= 0:
+                batch.append(items.get_nowait())
+            else:
+                batch.append(items.get(timeout=timeout))
+        except queue.Empty:
+            break
+    return batch
+
+
 def msgspec_encode_np(obj):
+    """The `enc_hook` for both the JSON and msgpack encoders."""
     if isinstance(obj, np.ndarray):
         return obj.tolist()
+    if isinstance(obj, SparseArray):
+        return obj.to_dict()
     raise NotImplementedError(f"unknown type {type(obj)} for msgspec encoder")
@@ -0,0 +1,158 @@
+import asyncio
+
+import httpx
+import pytest
+
+from qtext import breaker as breaker_module
+from qtext.breaker import CircuitBreaker, CircuitOpenError, CircuitState
+from qtext.config import BreakerConfig
+from qtext.engine import call_with_budget
+from qtext.utils import DeadlineExceededError
+
+
+def breaker(**kwargs) -> CircuitBreaker:
+    return CircuitBreaker("test", BreakerConfig(failure_threshold=2, **kwargs))
+
+
+def late_embedding(text: str, timeout: float | None = None) -> list[float]:
+    raise httpx.ReadTimeout("timed out")
+
+
+def test_tiny_deadlines_do_not_open_the_breaker():
+    circuit = breaker()
+    for budget in (0.001, 0.0, 0.001, 0.0, 0.001):
+        with pytest.raises(DeadlineExceededError):
+            circuit.call(call_with_budget, late_embedding, "query", budget, 10)
+    assert circuit.closed
+
+
+def test_client_timeouts_open_the_breaker():
+    circuit = breaker()
+    for budget in (None, 30):
+        with pytest.raises(httpx.ReadTimeout):
+            circuit.call(call_with_budget, late_embedding, "query", budget, 10)
+    assert not circuit.closed
+
+
+def test_slow_calls_out_of_the_deadline_still_count():
+    circuit = breaker(latency_threshold=1e-9)
+    for _ in range(2):
+        with pytest.raises(DeadlineExceededError):
+            circuit.call(call_with_budget, late_embedding, "query", 0.5, 10)
+    assert not circuit.closed
+
+
+def test_the_budget_is_the_call_timeout():
+    timeouts = []
+
+    def embedding(text: str, timeout: float | None = None) -> list[float]:
+        timeouts.append(timeout)
+        return [0.0]
+
+    call_with_budget(embedding, "query", 0.5, 10)
+    call_with_budget(embedding, "query", 20, 10)
+    call_with_budget(embedding, "query", None, 10)
+    assert timeouts == [0.5, None, None]
+
+
+def fail():
+    raise RuntimeError("unavailable")
+
+
+def open_circuit(circuit: CircuitBreaker):
+    for _ in range(circuit.failure_threshold):
+        with pytest.raises(RuntimeError):
+            circuit.call(fail)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(breaker_module, "monotonic", lambda: now[0])
+    return now
+
+
+def test_breaker_opens_after_consecutive_failures():
+    circuit = breaker()
+    with pytest.raises(RuntimeError):
+        circuit.call(fail)
+    assert circuit.call(lambda: 1) == 1
+    with pytest.raises(RuntimeError):
+        circuit.call(fail)
+    assert circuit.closed
+    with pytest.raises(RuntimeError):
+        circuit.call(fail)
+    assert circuit.state == CircuitState.OPEN
+    with pytest.raises(CircuitOpenError):
+        circuit.call(lambda: 1)
+
+
+def test_breaker_probe(clock):
+    circuit = breaker(reset_timeout=10)
+    open_circuit(circuit)
+    clock[0] += 10
+    # a failed probe opens the circuit again
+    with pytest.raises(RuntimeError):
+        circuit.call(fail)
+    assert circuit.state == CircuitState.OPEN
+    clock[0] += 10
+    assert circuit.call(lambda: 1) == 1
+    assert circuit.closed
+
+
+def test_breaker_single_probe(clock):
+    circuit = breaker(reset_timeout=10)
+    open_circuit(circuit)
+    clock[0] += 10
+    probe = circuit.allow()
+    assert probe
+    with pytest.raises(CircuitOpenError):
+        circuit.allow()
+    # a late call that started before the circuit opened doesn't decide
+    circuit.record(success=True)
+    assert circuit.state == CircuitState.HALF_OPEN
+    circuit.record(success=True, probe=probe)
+    assert circuit.closed
+
+
+def test_breaker_releases_an_interrupted_probe(clock):
+    circuit = breaker(reset_timeout=10)
+    open_circuit(circuit)
+    clock[0] += 10
+
+    def interrupt():
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        circuit.call(interrupt)
+    assert not circuit.probing
+    assert circuit.call(lambda: 1) == 1
+    assert circuit.closed
+
+
+def test_breaker_counts_slow_calls():
+    circuit = breaker(latency_threshold=1e-9)
+    circuit.call(lambda: 1)
+    circuit.call(lambda: 1)
+    assert circuit.state == CircuitState.OPEN
+
+
+def test_breaker_disabled():
+    circuit = breaker(enabled=False)
+    open_circuit(circuit)
+    assert circuit.call(lambda: 1) == 1
+
+
+def test_async_breaker_cancellation_is_not_a_failure():
+    circuit = breaker()
+
+    async def main():
+        task = asyncio.ensure_future(circuit.acall(asyncio.sleep, 10))
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    for _ in range(3):
+        asyncio.run(main())
+    assert circuit.closed
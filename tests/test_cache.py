@@ -0,0 +1,100 @@
+import numpy as np
+
+from qtext import cache
+from qtext.cache import LRUCache, ScoreCache, SemanticCache, normalize_query
+
+
+def test_lru_evicts_the_least_recently_used():
+    lru: LRUCache[str, int] = LRUCache("test", max_size=2)
+    lru.put("a", 1)
+    lru.put("b", 2)
+    assert lru.get("a") == 1
+    lru.put("c", 3)
+    assert lru.get("b") is None
+    assert (lru.get("a"), lru.get("c")) == (1, 3)
+
+
+def test_lru_disabled():
+    lru: LRUCache[str, int] = LRUCache("test", max_size=0)
+    lru.put("a", 1)
+    assert lru.get("a") is None
+    assert len(lru) == 0
+
+
+def test_lru_ttl(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(cache, "monotonic", lambda: now[0])
+    lru: LRUCache[str, int] = LRUCache("test", max_size=2, ttl=10)
+    lru.put("a", 1)
+    now[0] += 5
+    assert lru.get("a") == 1
+    now[0] += 10
+    assert lru.get("a") is None
+    assert len(lru) == 0
+
+
+def test_lru_weight():
+    lru: LRUCache[str, bytes] = LRUCache("test", max_size=10, weigher=len, max_weight=5)
+    lru.put("a", b"aa")
+    lru.put("b", b"bbb")
+    lru.put("c", b"c")
+    assert lru.get("a") is None
+    assert lru.weight == len(b"bbb") + len(b"c")
+    # too heavy to be cached at all
+    lru.put("d", b"dddddd")
+    assert lru.get("d") is None
+    lru.invalidate("b")
+    assert lru.weight == len(b"c")
+
+
+def test_normalize_query():
+    assert normalize_query("  hello \n  world ") == "hello world"
+
+
+def test_score_cache_only_scores_the_missing_docs():
+    calls = []
+
+    def score(query: str, docs: list[str]) -> list[float]:
+        calls.append(docs)
+        return [float(len(doc)) for doc in docs]
+
+    scores = ScoreCache("test", "model", max_size=8)
+    assert scores.score("q", ["a", "bb"], score) == [1.0, 2.0]
+    assert scores.score("q", ["bb", "ccc", "a"], score) == [2.0, 3.0, 1.0]
+    assert calls == [["a", "bb"], ["ccc"]]
+    # a different query is another key
+    scores.score("other", ["a"], score)
+    assert calls[-1] == ["a"]
+
+
+def test_semantic_cache_threshold_and_scope():
+    semantic: SemanticCache[str] = SemanticCache("test", max_size=4, threshold=0.95)
+    scope = ("ns", 1, b"limit=10")
+    semantic.put(scope, [1.0, 0.0], "x")
+    assert semantic.get(scope, [2.0, 0.1]) == "x"
+    assert semantic.get(scope, [0.0, 1.0]) is None
+    assert semantic.get(("ns", 1, b"limit=5"), [1.0, 0.0]) is None
+    assert semantic.get(scope, [0.0, 0.0]) is None
+
+
+def test_semantic_cache_drops_the_old_versions():
+    semantic: SemanticCache[str] = SemanticCache("test", max_size=4, threshold=0.9)
+    semantic.put(("ns", 1, b""), [1.0, 0.0], "old")
+    semantic.put(("other", 1, b""), [1.0, 0.0], "other")
+    assert semantic.get(("ns", 2, b""), [1.0, 0.0]) is None
+    assert len(semantic) == 1
+    # a stale version is never stored
+    semantic.put(("ns", 1, b""), [1.0, 0.0], "stale")
+    assert semantic.get(("ns", 2, b""), [1.0, 0.0]) is None
+    assert semantic.get(("other", 1, b""), [1.0, 0.0]) == "other"
+
+
+def test_semantic_cache_lru():
+    semantic: SemanticCache[int] = SemanticCache("test", max_size=2, threshold=0.99)
+    scope = ("ns", 1, b"")
+    vectors = np.eye(3)
+    for i in range(3):
+        semantic.put(scope, vectors[i], i)
+    assert semantic.get(scope, vectors[0]) is None
+    assert semantic.get(scope, vectors[1]) == 1
+    assert semantic.get(scope, vectors[2]) == 2  # noqa: PLR2004
@@ -0,0 +1,89 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import pytest
+
+from qtext.breaker import CircuitBreaker
+from qtext.coalesce import AsyncCoalescer, Coalescer
+from qtext.config import BreakerConfig
+
+BATCH = 4
+
+
+def call_all(coalescer: Coalescer, items: list) -> list:
+    """Call concurrently, return the results or the exceptions."""
+
+    def call(item):
+        try:
+            return coalescer(item, timeout=5)
+        except Exception as err:
+            return err
+
+    with ThreadPoolExecutor(len(items)) as executor:
+        return list(executor.map(call, items))
+
+
+def test_coalescer_batches_the_calls():
+    batches = []
+
+    def double(items: list[int]) -> list[int]:
+        batches.append(items)
+        return [item * 2 for item in items]
+
+    coalescer = Coalescer("test", double, window=0.2, max_batch=BATCH)
+    assert call_all(coalescer, list(range(BATCH))) == [0, 2, 4, 6]
+    assert len(batches) == 1
+
+
+def test_coalescer_fails_the_missing_results():
+    coalescer = Coalescer("test", lambda items: items[:1], window=0.2, max_batch=BATCH)
+    results = call_all(coalescer, list(range(BATCH)))
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+def test_coalescer_records_one_failure_per_batch():
+    breaker = CircuitBreaker("test", BreakerConfig(failure_threshold=2))
+
+    def fail(items: list[int]) -> list[int]:
+        raise RuntimeError("unavailable")
+
+    coalescer = Coalescer(
+        "test", partial(breaker.call, fail), window=0.2, max_batch=BATCH
+    )
+    results = call_all(coalescer, list(range(BATCH)))
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert breaker.closed
+
+
+def test_async_coalescer_fails_the_missing_results():
+    async def first(items: list[int]) -> list[int]:
+        return items[:1]
+
+    async def main():
+        coalescer = AsyncCoalescer("test", first, window=0.01, max_batch=BATCH)
+        return await asyncio.gather(
+            *(coalescer(item) for item in range(BATCH)), return_exceptions=True
+        )
+
+    results = asyncio.run(main())
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+@pytest.mark.parametrize("size", [1, BATCH])
+def test_async_coalescer_records_one_failure_per_batch(size):
+    breaker = CircuitBreaker("test", BreakerConfig(failure_threshold=2))
+
+    async def fail(items: list[int]) -> list[int]:
+        raise RuntimeError("unavailable")
+
+    async def main():
+        coalescer = AsyncCoalescer(
+            "test", partial(breaker.acall, fail), window=0.01, max_batch=BATCH
+        )
+        return await asyncio.gather(
+            *(coalescer(item) for item in range(size)), return_exceptions=True
+        )
+
+    assert all(isinstance(result, RuntimeError) for result in asyncio.run(main()))
+    assert breaker.closed
@@ -0,0 +1,75 @@
+import asyncio
+import time
+
+import httpx
+
+from qtext.async_engine import AsyncRetrievalEngine
+from qtext.engine import POOLS, LegResult, RetrievalEngine
+from qtext.ranker import OnnxCrossEncoder, Ranker, ReRanker, TimeDecayRanker
+from qtext.spec import QueryDocRequest, Record
+from qtext.utils import BoundedExecutor, Deadline
+
+DELAY = 0.5
+
+
+class SlowRanker(Ranker):
+    """An expensive local ranker that reverses the docs."""
+
+    inline = False
+
+    def rank(self, query: Record, docs: list[Record]) -> list[Record]:
+        time.sleep(DELAY)
+        return docs[::-1]
+
+
+def engine(ranker: Ranker) -> RetrievalEngine:
+    engine = RetrievalEngine.__new__(RetrievalEngine)
+    engine.ranker = ranker
+    engine.pools = {name: BoundedExecutor(name, 2) for name in POOLS}
+    return engine
+
+
+def retrieved() -> list[Record]:
+    return [
+        Record(id=0, text="a", vector_pos=3, text_pos=3),
+        Record(id=1, text="b", vector_pos=1, text_pos=1),
+        Record(id=2, text="c", vector_pos=2, text_pos=2),
+    ]
+
+
+def test_expensive_local_rankers_run_within_the_deadline():
+    req = QueryDocRequest(namespace="test", query="q", limit=3)
+    start_time = time.perf_counter()
+    ranked, reranked = engine(SlowRanker()).rank_within(
+        req, retrieved(), Deadline(0.05)
+    )
+    assert time.perf_counter() - start_time < DELAY / 2
+    assert not reranked
+    # the RRF of the retrieval positions
+    assert [doc.id for doc in ranked] == [1, 2, 0]
+
+    ranked, reranked = engine(SlowRanker()).rank_within(req, retrieved(), Deadline())
+    assert reranked
+    assert [doc.id for doc in ranked] == [2, 1, 0]
+
+
+def test_inline_rankers():
+    assert TimeDecayRanker.inline
+    assert not OnnxCrossEncoder.inline
+    assert not OnnxCrossEncoder.remote
+    assert not ReRanker([TimeDecayRanker(), SlowRanker()]).inline
+
+
+def test_async_retrieve_skips_the_timeouts():
+    async def late_leg(req: QueryDocRequest) -> LegResult:
+        raise httpx.ReadTimeout("timed out")
+
+    async def leg(req: QueryDocRequest) -> LegResult:
+        return [], 0.0
+
+    engine = AsyncRetrievalEngine.__new__(AsyncRetrievalEngine)
+    engine.text_leg, engine.vector_leg, engine.sparse_leg = late_leg, leg, leg
+    req = QueryDocRequest(namespace="test", query="q")
+    results, skipped = asyncio.run(engine.retrieve(req, Deadline(1)))
+    assert skipped == ["text"]
+    assert results["text"] == ([], 0.0)
@@ -0,0 +1,99 @@
+import time
+from contextlib import contextmanager
+
+import psycopg
+import pytest
+
+from qtext.config import IngestConfig
+from qtext.ingest import IngestQueue
+from qtext.pg_client import NamespaceVersions, PgVectorsClient
+from qtext.schema import DefaultTable, Querier
+from qtext.spec import IngestStatus
+
+
+class FakeCopy:
+    def __init__(self, conn: "FakeConnection") -> None:
+        self.conn = conn
+
+    def set_types(self, types: list[str]):
+        pass
+
+    def write_row(self, row: list):
+        if "bad" in row:
+            raise psycopg.errors.DataError("bad row")
+        self.conn.pending.append(row[0])
+
+
+class FakeConnection:
+    """Keep the copied text rows, they're only visible after the commit."""
+
+    def __init__(self) -> None:
+        self.pending: list[str] = []
+        self.rows: list[str] = []
+        self.commits = 0
+
+    @contextmanager
+    def cursor(self):
+        yield self
+
+    @contextmanager
+    def copy(self, query):
+        yield FakeCopy(self)
+
+    def commit(self):
+        self.rows.extend(self.pending)
+        self.pending.clear()
+        self.commits += 1
+
+    def rollback(self):
+        self.pending.clear()
+
+
+def pg_client(copy_batch_size: int) -> PgVectorsClient:
+    client = PgVectorsClient.__new__(PgVectorsClient)
+    client.querier = Querier(DefaultTable)
+    client.copy_batch_size = copy_batch_size
+    client.versions = NamespaceVersions()
+    client.pool = None
+    client.conn = FakeConnection()
+    return client
+
+
+Request = Querier(DefaultTable).generate_request_class()
+
+
+def docs(*texts: str) -> list:
+    return [Request(namespace="test", text=text) for text in texts]
+
+
+def test_add_docs_writes_all_or_nothing():
+    client = pg_client(copy_batch_size=2)
+    with pytest.raises(RuntimeError):
+        # the first COPY batch succeeds before the bad doc fails
+        client.add_docs(docs("a", "b", "c", "bad"))
+    assert client.conn.rows == []
+    assert client.versions.get("test") == 0
+
+    client.add_docs(docs("a", "b", "c"))
+    assert client.conn.rows == ["a", "b", "c"]
+    assert client.conn.commits == 1
+    assert client.versions.get("test") > 0
+
+
+def test_ingest_retry_after_a_partial_write():
+    client = pg_client(copy_batch_size=2)
+    ingest = IngestQueue(
+        IngestConfig(workers=1, batch_size=8, linger=0.2), client.add_docs
+    )
+    texts = ["a", "b", "c", "bad", "d"]
+    tickets = [ingest.submit(doc) for doc in docs(*texts)]
+    for _ in range(100):
+        statuses = [ingest.status(ticket) for ticket in tickets]
+        if IngestStatus.QUEUED not in statuses:
+            break
+        time.sleep(0.05)
+    assert statuses == [
+        IngestStatus.FAILED if text == "bad" else IngestStatus.DONE for text in texts
+    ]
+    # the docs copied before the failure are not written twice
+    assert sorted(client.conn.rows) == ["a", "b", "c", "d"]
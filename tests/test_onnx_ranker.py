@@ -0,0 +1,117 @@
+import asyncio
+import sys
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from qtext.ranker import OnnxCrossEncoder
+from qtext.spec import Record
+
+onnx = pytest.importorskip("onnx")
+pytest.importorskip("onnxruntime")
+
+VOCAB = 97
+
+
+class StubTokenizer:
+    """Hash the words to ids and pad to the longest pair of the batch."""
+
+    padding = None
+
+    @classmethod
+    def from_file(cls, path: str) -> "StubTokenizer":
+        return cls()
+
+    def enable_truncation(self, max_length: int):
+        self.max_length = max_length
+
+    def enable_padding(self, pad_id: int, pad_token: str):
+        self.pad_id = pad_id
+
+    def encode_batch(self, pairs: list[tuple[str, str]]) -> list[SimpleNamespace]:
+        ids = [
+            [sum(map(ord, word)) % (VOCAB - 1) + 1 for word in f"{q} {t}".split()]
+            for q, t in pairs
+        ]
+        ids = [seq[: self.max_length] for seq in ids]
+        length = max(map(len, ids))
+        return [
+            SimpleNamespace(
+                ids=seq + [self.pad_id] * (length - len(seq)),
+                attention_mask=[1] * len(seq) + [0] * (length - len(seq)),
+                type_ids=[0] * length,
+            )
+            for seq in ids
+        ]
+
+
+def random_model(path: str):
+    """Sum the random embeddings of the unmasked tokens, 2 logits per pair."""
+    helper = onnx.helper
+    rng = np.random.default_rng(0)
+    embedding = rng.standard_normal((VOCAB, 2)).astype(np.float32)
+    graph = helper.make_graph(
+        [
+            helper.make_node("Gather", ["embedding", "input_ids"], ["embedded"]),
+            helper.make_node("Cast", ["attention_mask"], ["mask"], to=1),
+            helper.make_node("Unsqueeze", ["mask", "last"], ["mask3"]),
+            helper.make_node("Mul", ["embedded", "mask3"], ["masked"]),
+            helper.make_node("ReduceSum", ["masked", "tokens"], ["logits"], keepdims=0),
+        ],
+        "tiny_cross_encoder",
+        [
+            helper.make_tensor_value_info(
+                "input_ids", onnx.TensorProto.INT64, ["b", "l"]
+            ),
+            helper.make_tensor_value_info(
+                "attention_mask", onnx.TensorProto.INT64, ["b", "l"]
+            ),
+        ],
+        [helper.make_tensor_value_info("logits", onnx.TensorProto.FLOAT, ["b", 2])],
+        [
+            onnx.numpy_helper.from_array(embedding, "embedding"),
+            onnx.numpy_helper.from_array(np.array([-1], dtype=np.int64), "last"),
+            onnx.numpy_helper.from_array(np.array([1], dtype=np.int64), "tokens"),
+        ],
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 8
+    onnx.save(model, path)
+
+
+@pytest.fixture
+def ranker(tmp_path, monkeypatch):
+    monkeypatch.setitem(
+        sys.modules, "tokenizers", SimpleNamespace(Tokenizer=StubTokenizer)
+    )
+    model_path = str(tmp_path / "model.onnx")
+    random_model(model_path)
+    return OnnxCrossEncoder(model_path, batch_size=2, cache_size=0)
+
+
+def test_scores_keep_the_input_order(ranker):
+    query = Record(text="what is the fastest language")
+    texts = [
+        "Rust is not always faster than Python",
+        "the early bird",
+        "Life is short, I use Python and sometimes a bit of C",
+        "C",
+        "benchmarks are hard to read",
+    ]
+    docs = [Record(id=i, text=text) for i, text in enumerate(texts)]
+    # one pair per inference has no padding and no reordering
+    expected = [ranker.inference(query.text, [text])[0] for text in texts]
+    np.testing.assert_allclose(ranker.score(query, docs), expected, rtol=1e-6)
+
+    ranked, scores = ranker.rank_with_scores(query, docs)
+    assert [doc.id for doc in ranked] == list(np.argsort(expected, kind="stable")[::-1])
+    assert np.all(np.diff(scores) <= 0)
+
+
+def test_arank_matches_rank(ranker):
+    query = Record(text="python")
+    docs = [Record(id=i, text=f"doc {'word ' * i}{i}") for i in range(7)]
+    ranked = ranker.rank(query, docs)
+    aranked = asyncio.run(ranker.arank(query, docs))
+    assert [doc.id for doc in aranked] == [doc.id for doc in ranked]
@@ -0,0 +1,138 @@
+import numpy as np
+import pytest
+
+from qtext.ranker import (
+    Columns,
+    Distance,
+    DiverseRanker,
+    ReRanker,
+    RRFRanker,
+    ScoreRanker,
+    top_k_indices,
+)
+from qtext.spec import Record
+
+
+def stable_top_k(scores: np.ndarray, top_k: int) -> np.ndarray:
+    keys = np.where(np.isnan(scores), -np.inf, scores)
+    order = np.argsort(-keys, kind="stable")
+    return order[:top_k] if top_k else order
+
+
+@pytest.mark.parametrize("top_k", [0, 1, 3, 10, 50])
+def test_top_k_indices_matches_stable_sort(top_k):
+    rng = np.random.default_rng(top_k)
+    for _ in range(100):
+        # few distinct values to get many ties
+        scores = rng.integers(0, 5, size=rng.integers(1, 40)).astype(np.float64)
+        np.testing.assert_array_equal(
+            top_k_indices(scores, top_k), stable_top_k(scores, top_k)
+        )
+
+
+@pytest.mark.parametrize("top_k", [0, 1, 2, 4, 6])
+def test_top_k_indices_with_nan(top_k):
+    scores = np.array([0.5, np.nan, 0.9, -np.inf, np.nan, 0.5])
+    indices = top_k_indices(scores, top_k)
+    assert len(indices) == (top_k or len(scores))
+    np.testing.assert_array_equal(indices, stable_top_k(scores, top_k))
+    assert list(top_k_indices(scores)) == [2, 0, 5, 1, 3, 4]
+
+
+def test_rrf():
+    docs = [
+        Record(id=0, text="a", vector_pos=2, text_pos=0),
+        Record(id=1, text="b", vector_pos=0),
+        Record(id=2, text="c", vector_pos=1, sparse_pos=1, text_pos=1),
+    ]
+    ranked, scores = RRFRanker(k=1).rank_with_scores(Record(text="q"), docs)
+    assert [doc.id for doc in ranked] == [2, 0, 1]
+    np.testing.assert_allclose(scores, [3 / 3, 1 / 4 + 1 / 2, 1 / 2])
+    ranked = RRFRanker(k=1, vector_weight=10, top_k=1).rank(Record(text="q"), docs)
+    assert [doc.id for doc in ranked] == [1]
+
+
+class ByText(ScoreRanker):
+    """Score the docs by their text as a number, and record the scored docs."""
+
+    def __init__(self) -> None:
+        self.seen: list[list[int]] = []
+
+    def score_columns(self, columns: Columns) -> np.ndarray:
+        self.seen.append([doc.id for doc in columns.docs])
+        return np.array([float(doc.text) for doc in columns.docs])
+
+
+class Reverse(ByText):
+    def score_columns(self, columns: Columns) -> np.ndarray:
+        return -super().score_columns(columns)
+
+
+def numbered(*scores: float) -> list[Record]:
+    return [Record(id=i, text=str(score)) for i, score in enumerate(scores)]
+
+
+def test_reranker_keeps_the_survivors():
+    first, second = ByText(), Reverse()
+    ranker = ReRanker([first, second], keep=[2, 0])
+    ranked = ranker.rank(Record(text="q"), numbered(1, 5, 3, 4))
+    assert first.seen == [[0, 1, 2, 3]]
+    assert second.seen == [[1, 3]]
+    assert [doc.id for doc in ranked] == [3, 1]
+
+
+def test_reranker_stops_after_a_decisive_step():
+    first, second = ByText(), Reverse()
+    ranker = ReRanker([first, second], margin=[1.0, 0])
+    ranked = ranker.rank(Record(text="q"), numbered(1, 5, 3))
+    assert second.seen == []
+    assert [doc.id for doc in ranked] == [1, 2, 0]
+    # not decisive, the second step runs
+    ranker.rank(Record(text="q"), numbered(1, 5, 4.5))
+    assert second.seen == [[1, 2, 0]]
+
+
+def test_reranker_requires_matching_params():
+    with pytest.raises(ValueError):
+        ReRanker([])
+    with pytest.raises(ValueError):
+        ReRanker([ByText()], keep=[1, 2])
+
+
+def pairwise_mmr(ranker: DiverseRanker, query: Record, docs: list[Record]) -> list:
+    """The pairwise MMR, which the vectorized `DiverseRanker` must match."""
+    distance = ranker.distance
+    query_sim = [distance(query.vector, doc.vector) for doc in docs]
+    candidates, selected = list(range(len(docs))), []
+    while candidates:
+        scores = [
+            ranker.lambda_const * query_sim[c]
+            - (1 - ranker.lambda_const)
+            * max(
+                (distance(docs[c].vector, docs[s].vector) for s in selected), default=0
+            )
+            for c in candidates
+        ]
+        if max(scores) < ranker.threshold:
+            break
+        selected.append(candidates.pop(scores.index(max(scores))))
+    return [docs[i].id for i in selected]
+
+
+@pytest.mark.parametrize(
+    "distance", [Distance.COSINE, Distance.DOT_PRODUCT, Distance.EUCLIDEAN]
+)
+@pytest.mark.parametrize("threshold", [-np.inf, 0.0])
+def test_diverse_ranker_matches_the_pairwise_mmr(distance, threshold):
+    rng = np.random.default_rng(7)
+    ranker = DiverseRanker(lambda_const=0.5, threshold=threshold, distance=distance)
+    for _ in range(20):
+        vectors = rng.standard_normal((rng.integers(1, 12), 4))
+        # duplicate docs tie, they must keep the doc order
+        vectors[-1] = vectors[0]
+        docs = [
+            Record(id=i, text="", vector=vector) for i, vector in enumerate(vectors)
+        ]
+        query = Record(text="", vector=rng.standard_normal(4))
+        ids = [doc.id for doc in ranker.rank(query, docs)]
+        assert ids == pairwise_mmr(ranker, query, docs)
@@ -0,0 +1,86 @@
+from dataclasses import dataclass, field
+
+import pytest
+
+from qtext.schema import DefaultTable, Querier
+from qtext.spec import MetadataFilter
+
+FILTER = MetadataFilter(
+    equal={"author": "alice"}, gte={"score": 0.5}, contains={"tags": ["a", "b"]}
+)
+
+
+@dataclass(kw_only=True)
+class NoPrimaryKey:
+    text: str = field(metadata={"text_index": True})
+
+
+def render(composable) -> str:
+    return composable.as_string(None)
+
+
+def test_filter_clause():
+    querier = Querier(DefaultTable)
+    assert render(querier.filter_clause(FILTER)) == (
+        '"author" = %(filter_0)s AND "score" >= %(filter_1)s AND '
+        '"tags" @> ARRAY[%(filter_2)s, %(filter_3)s]::TEXT[]'
+    )
+    assert Querier.filter_params(FILTER) == {
+        "filter_0": "alice",
+        "filter_1": 0.5,
+        "filter_2": "a",
+        "filter_3": "b",
+    }
+    assert querier.filter_clause(None) is None
+    assert querier.filter_clause(MetadataFilter()) is None
+
+
+def test_filter_unknown_column():
+    with pytest.raises(ValueError, match="unknown filter column"):
+        Querier(DefaultTable).filter_clause(MetadataFilter(equal={"missing": 1}))
+
+
+def test_filter_in_the_queries():
+    querier = Querier(DefaultTable)
+    vector = render(querier.vector_query("doc", ["id"], FILTER))
+    assert vector.startswith(
+        'SELECT "id", "vector" <#> %(vector)s AS rank FROM "doc" WHERE "author" = '
+    )
+    assert vector.endswith("ORDER by rank LIMIT %(limit)s;")
+    text = render(querier.text_query("doc", ["id"], FILTER))
+    assert 'WHERE fts_vector @@ query AND "author" = %(filter_0)s' in text
+    assert render(querier.vector_query("doc", ["id"])) == (
+        'SELECT "id", "vector" <#> %(vector)s AS rank FROM "doc" '
+        "ORDER by rank LIMIT %(limit)s;"
+    )
+
+
+def test_hybrid_query():
+    hybrid = render(Querier(DefaultTable).hybrid_query("doc", ["id", "text"], FILTER))
+    for leg, order in (("vector", "ASC"), ("sparse", "ASC"), ("text", "DESC")):
+        assert (
+            f'"{leg}_leg" AS (SELECT *, ROW_NUMBER() OVER (ORDER BY rank {order}) - 1'
+            in hybrid
+        )
+        assert f'"{leg}_leg".pos AS "{leg}_pos"' in hybrid
+    # the filter is applied in every leg
+    assert hybrid.count('"author" = %(filter_0)s') == 3  # noqa: PLR2004
+    assert hybrid.endswith(
+        'FROM "vector_leg" FULL OUTER JOIN "sparse_leg" USING ("id") '
+        'FULL OUTER JOIN "text_leg" USING ("id") JOIN "doc" USING ("id") '
+        'ORDER BY LEAST("vector_leg".pos, "sparse_leg".pos, "text_leg".pos) '
+        'NULLS LAST, "doc"."id";'
+    )
+
+
+def test_hybrid_query_requires_a_primary_key():
+    with pytest.raises(ValueError, match="primary key"):
+        Querier(NoPrimaryKey).hybrid_query("doc")
+
+
+def test_projection():
+    querier = Querier(DefaultTable, required_fields=["text", "vector"])
+    columns = querier.projection(["title"])
+    assert {"id", "text", "vector", "title"} <= set(columns)
+    assert "sparse_vector" not in columns
+    assert Querier(DefaultTable).projection() == Querier(DefaultTable).columns()
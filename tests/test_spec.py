@@ -0,0 +1,51 @@
+import msgspec
+import numpy as np
+import pytest
+
+from qtext.spec import SparseArray, SparseEmbedding
+from qtext.utils import msgspec_encode_np
+
+
+def sparse() -> SparseArray:
+    return SparseArray(8, [1, 3, 6], [0.5, -1.0, 2.0])
+
+
+def test_sparse_array_bytes():
+    array = sparse()
+    decoded = SparseArray.from_bytes(array.to_bytes())
+    assert decoded == array
+    assert decoded.dim == array.dim
+
+
+@pytest.mark.parametrize("protocol", [msgspec.json, msgspec.msgpack])
+def test_sparse_array_encoding(protocol):
+    array = sparse()
+    encoded = protocol.encode(array, enc_hook=msgspec_encode_np)
+    # the same wire format as the `SparseEmbedding`
+    assert encoded == protocol.encode(array.to_embedding())
+    assert protocol.decode(encoded, type=SparseEmbedding) == array
+
+
+def test_sparse_array_embedding():
+    embedding = sparse().to_embedding()
+    assert SparseArray.from_embedding(embedding) == sparse()
+    assert sparse() == embedding
+
+
+def test_sparse_array_sorts_the_indices():
+    array = SparseArray(8, [6, 1, 3], [2.0, 0.5, -1.0])
+    assert array == sparse()
+
+
+@pytest.mark.parametrize("indices", [[1, 1, 3], [-1, 3, 6], [1, 3]])
+def test_sparse_array_validation(indices):
+    with pytest.raises(ValueError):
+        SparseArray(8, indices, [0.5, -1.0, 2.0])
+
+
+def test_sparse_array_dot():
+    array = sparse()
+    other = SparseArray(8, [0, 3, 6], [1.0, 2.0, 3.0])
+    assert array.dot(other) == pytest.approx(array.to_dense() @ other.to_dense())
+    dense = np.arange(8, dtype=np.float32)
+    assert array.dot(dense) == pytest.approx(array.to_dense() @ dense)